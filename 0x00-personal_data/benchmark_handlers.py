@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmark of the handlers of the user_data logger.
+
+Logs the same records through a plain StreamHandler and through a
+BufferedRedactingHandler writing to a file, and reports for each the
+number of write system calls (from /proc/self/io when available,
+otherwise the writes counted by the handler) and the per-record
+latency of logger.info.
+
+Usage:
+    ./benchmark_handlers.py [-n RECORDS] [--max-records N]
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from filtered_logger import (PII_FIELDS, BufferedRedactingHandler,
+                             RedactingFormatter)
+
+MESSAGE = "name=Bob;email=bob@dylan.com;phone=555;ssn=000-00-0000;" \
+    "password=bobby2019;ip=192.168.0.1;user_agent=Mozilla/5.0;"
+
+
+def write_syscalls() -> int:
+    """
+    Returns the number of write system calls of this process so far,
+    or -1 when /proc/self/io is not available.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("syscw:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return -1
+
+
+def run(handler: logging.Handler, records: int) -> Dict[str, float]:
+    """
+    Logs records messages through handler and measures the writes and
+    the latency of each call.
+    """
+    handler.setFormatter(RedactingFormatter(PII_FIELDS))
+    logger = logging.getLogger("user_data.benchmark")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    clock = time.perf_counter_ns
+    latencies = []
+    syscalls = write_syscalls()
+    start = clock()
+    for _ in range(records):
+        begin = clock()
+        logger.info(MESSAGE)
+        latencies.append(clock() - begin)
+    handler.flush()
+    elapsed = clock() - start
+    if syscalls >= 0:
+        syscalls = write_syscalls() - syscalls
+    else:
+        syscalls = getattr(handler, "writes", records)
+    handler.close()
+    latencies.sort()
+    return {
+        "write_syscalls": syscalls,
+        "records_per_s": records / (elapsed / 1e9),
+        "p50_us": latencies[len(latencies) // 2] / 1e3,
+        "p99_us": latencies[int(len(latencies) * 0.99)] / 1e3,
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the handlers of the user_data logger.")
+    parser.add_argument('-n', '--records', type=int, default=20000)
+    parser.add_argument('--max-records', type=int, default=256,
+                        help="batch size of the buffered handler")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryFile("w") as stream:
+        results = {
+            "StreamHandler": run(logging.StreamHandler(stream),
+                                 args.records),
+            "BufferedRedactingHandler": run(
+                BufferedRedactingHandler(stream, max_bytes=1 << 20,
+                                         max_records=args.max_records,
+                                         interval=None),
+                args.records),
+        }
+    for name, result in results.items():
+        print("{:<26} {write_syscalls:>8} writes {records_per_s:>12,.0f} "
+              "rec/s  p50 {p50_us:7.2f}us  p99 {p99_us:7.2f}us".format(
+                  name, **result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmarks for the redaction layer of filtered_logger.
+
+Measures filter_datum, RedactingFormatter.format and the get_logger()
+pipeline over a grid of field counts, message lengths, match densities
+and separators. For each case it reports throughput (records/s),
+per-record latency percentiles and the memory allocated while
+redacting.
+
+Usage:
+    ./benchmark_redaction.py [-n RECORDS] [--save FILE] [--compare FILE]
+
+--save writes the results as a JSON baseline; --compare prints the
+change of every case against such a baseline.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import filtered_logger
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+FIELD_COUNTS = (5, 50, 500)
+MESSAGE_PAIRS = (4, 16, 64)
+DENSITIES = (0.1, 0.5, 1.0)
+SEPARATORS = (";", "|")
+TARGETS = ("filter_datum", "format", "format_trie", "get_logger")
+
+
+def make_fields(count: int) -> List[str]:
+    """
+    Returns count field names, starting with PII_FIELDS.
+    """
+    extra = ["pii_field_{}".format(i) for i in range(count - len(PII_FIELDS))]
+    return list(PII_FIELDS[:count]) + extra
+
+
+def make_message(fields: List[str], pairs: int, density: float,
+                 separator: str) -> str:
+    """
+    Returns a message of pairs "key=value" items, a density share of
+    which have a key from fields.
+    """
+    matching = round(pairs * density)
+    items = []
+    for i in range(pairs):
+        if i < matching:
+            key = fields[i * 7 % len(fields)]
+        else:
+            key = "plain_{}".format(i)
+        items.append("{}=value-{}-{}{}".format(key, i, "x" * 8, separator))
+    return "".join(items)
+
+
+def make_record(message: str) -> logging.LogRecord:
+    """
+    Returns a user_data log record carrying message.
+    """
+    return logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                             message, None, None)
+
+
+def make_target(target: str, fields: List[str], message: str,
+                separator: str) -> Callable[[], object]:
+    """
+    Returns a callable that redacts one record with the given target.
+    """
+    if target == "filter_datum":
+        return lambda: filter_datum(fields, "***", message, separator)
+
+    matcher = "trie" if target == "format_trie" else "regex"
+    formatter = RedactingFormatter(fields, matcher=matcher)
+    if separator != formatter.SEPARATOR:
+        formatter.SEPARATOR = separator
+        formatter.plan = formatter.MATCHERS[matcher](
+            fields, formatter.REDACTION, separator)
+    if target in ("format", "format_trie"):
+        record = make_record(message)
+        return lambda: formatter.format(record)
+
+    logger = filtered_logger.get_logger()
+    handler = logger.handlers[-1]
+    handler.setFormatter(formatter)
+    if handler.stream is sys.stderr:
+        handler.setStream(open(os.devnull, "w"))
+    return lambda: logger.info(message)
+
+
+def percentile(sorted_values: List[int], share: float) -> float:
+    """
+    Returns the share percentile of sorted_values.
+    """
+    index = min(len(sorted_values) - 1, int(share * len(sorted_values)))
+    return sorted_values[index]
+
+
+def run_case(run: Callable[[], object], records: int) -> Dict[str, float]:
+    """
+    Times records calls of run, then measures the allocations of a
+    tenth of them.
+    """
+    for _ in range(min(records, 100)):
+        run()
+    clock = time.perf_counter_ns
+    latencies = []
+    start = clock()
+    for _ in range(records):
+        begin = clock()
+        run()
+        latencies.append(clock() - begin)
+    elapsed = clock() - start
+    latencies.sort()
+
+    sample = max(1, records // 10)
+    tracemalloc.start()
+    for _ in range(sample):
+        run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "records_per_s": records / (elapsed / 1e9),
+        "p50_us": percentile(latencies, 0.50) / 1e3,
+        "p90_us": percentile(latencies, 0.90) / 1e3,
+        "p99_us": percentile(latencies, 0.99) / 1e3,
+        "peak_alloc_bytes": peak,
+    }
+
+
+def run_benchmarks(records: int) -> Dict[str, Dict[str, float]]:
+    """
+    Runs every case of the grid and returns the results by case name.
+    """
+    results = {}
+    grid = itertools.product(TARGETS, FIELD_COUNTS, MESSAGE_PAIRS,
+                             DENSITIES, SEPARATORS)
+    for target, count, pairs, density, separator in grid:
+        fields = make_fields(count)
+        message = make_message(fields, pairs, density, separator)
+        name = "{} fields={} pairs={} density={} sep={}".format(
+            target, count, pairs, density, separator)
+        run = make_target(target, fields, message, separator)
+        results[name] = run_case(run, records)
+        print("{:<60} {records_per_s:>12,.0f} rec/s  p50 {p50_us:7.2f}us"
+              "  p99 {p99_us:7.2f}us  peak {peak_alloc_bytes:>8,}B".format(
+                  name, **results[name]))
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]],
+            baseline: Dict[str, Dict[str, float]]):
+    """
+    Prints the throughput and p99 change of every case against baseline.
+    """
+    print("\n{:<60} {:>10} {:>10}".format("case", "rec/s", "p99"))
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        print("{:<60} {:>+9.1f}% {:>+9.1f}%".format(
+            name,
+            100 * (result["records_per_s"] / before["records_per_s"] - 1),
+            100 * (result["p99_us"] / before["p99_us"] - 1)))
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the redaction of filtered_logger.")
+    parser.add_argument('-n', '--records', type=int, default=2000,
+                        help="records timed per case")
+    parser.add_argument('--save', help="write the results to this file")
+    parser.add_argument('--compare', help="baseline file to compare with")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.records)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
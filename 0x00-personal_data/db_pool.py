@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+
+"""
+Module for reusing database connections.
+
+get_db() opens a new connection, with its TCP and authentication
+handshakes, on every call. ConnectionPool keeps a bounded set of
+connections open and hands them out again, checking that they are
+still alive first.
+
+The pool does not depend on MySQL: any callable returning a DB-API
+connection can be used as its connect function, e.g. to run it on
+SQLite.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from filtered_logger import get_db
+
+
+def ping(connection: Any) -> bool:
+    """
+    Default health check: asks the connection whether it is still alive.
+    Uses is_connected() when the connector has it (mysql.connector),
+    otherwise runs a trivial query.
+    """
+    is_connected = getattr(connection, "is_connected", None)
+    try:
+        if is_connected is not None:
+            return bool(is_connected())
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+class ConnectionPool:
+    """ Pool of reusable database connections
+
+    Args:
+        connect (Callable): Opens a new connection, get_db by default.
+        size (int): Maximum number of open connections.
+        idle_timeout (float): Seconds after which an unused connection
+        is closed instead of being reused. None keeps them forever.
+        health_check (Callable): Returns whether a connection can be
+        reused; run each time an idle connection is checked out.
+        None disables the check.
+    """
+
+    def __init__(self, connect: Callable[[], Any] = get_db, size: int = 5,
+                 idle_timeout: float = 300,
+                 health_check: Callable[[Any], bool] = ping):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.closed = False
+        self._idle = deque()
+        self._opened = 0
+        self._condition = threading.Condition()
+
+    def _is_expired(self, last_used: float, now: float) -> bool:
+        """ Whether an idle connection was unused for too long
+        """
+        return self.idle_timeout is not None and \
+            now - last_used > self.idle_timeout
+
+    def _discard(self, connection: Any):
+        """ Closes a connection that leaves the pool
+        """
+        with self._condition:
+            self._opened -= 1
+            self._condition.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _reset(connection: Any) -> bool:
+        """ Rolls back the transaction left open on a connection, so that
+        the next borrower gets neither its writes nor its locks; returns
+        whether the connection can be reused
+        """
+        if not getattr(connection, "in_transaction", True):
+            return True
+        try:
+            connection.rollback()
+        except Exception:
+            return False
+        return True
+
+    def acquire(self, timeout: float = None) -> Any:
+        """
+        Checks out a connection, opening one if the pool is not full.
+        Args:
+            timeout (float): Seconds to wait for a connection when all
+            of them are in use. None waits forever.
+
+        Returns:
+            A connection, to be given back with release().
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._condition:
+                connection = None
+                while connection is None:
+                    if self.closed:
+                        raise RuntimeError("The connection pool is closed.")
+                    if self._idle:
+                        connection, last_used = self._idle.pop()
+                    elif self._opened < self.size:
+                        self._opened += 1
+                        break
+                    else:
+                        remaining = None if deadline is None \
+                            else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise TimeoutError(
+                                "No database connection available.")
+                        self._condition.wait(remaining)
+
+            if connection is None:
+                try:
+                    return self.connect()
+                except Exception:
+                    with self._condition:
+                        self._opened -= 1
+                        self._condition.notify()
+                    raise
+            if self._is_expired(last_used, time.monotonic()) or (
+                    self.health_check is not None and
+                    not self.health_check(connection)):
+                self._discard(connection)
+                continue
+            return connection
+
+    def release(self, connection: Any, discard: bool = False):
+        """
+        Gives a checked out connection back to the pool, rolling back
+        its uncommitted changes; it is discarded if that fails.
+        Args:
+            discard (bool): Close the connection instead of reusing it.
+        """
+        if discard or self.closed or not self._reset(connection):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None) -> Iterator[Any]:
+        """
+        Checks out a connection for the duration of a with block.
+        The transaction is committed when the block ends, and rolled
+        back if it raises; the connection is discarded if the commit or
+        the rollback fails.
+        """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection)
+            raise
+        try:
+            connection.commit()
+        except BaseException:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+
+    def close(self):
+        """
+        Closes the idle connections. Connections still checked out are
+        closed when they are released.
+        """
+        with self._condition:
+            self.closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._condition.notify_all()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def __enter__(self) -> 'ConnectionPool':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_db_pool() -> ConnectionPool:
+    """
+    Returns the process wide pool of get_db() connections.
+
+    Uses the PERSONAL_DATA_DB_* environment variables of get_db, and:
+        - PERSONAL_DATA_DB_POOL_SIZE (default: 5)
+        - PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT (seconds, default: 300)
+
+    Returns:
+        ConnectionPool: The shared pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ConnectionPool(
+                get_db,
+                size=int(os.getenv("PERSONAL_DATA_DB_POOL_SIZE", "5")),
+                idle_timeout=float(os.getenv(
+                    "PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT", "300")))
+        return _pool
@@ -5,17 +5,429 @@
 Module for filtering sensitive data in log messages.
 
 This module contains the filter_datum function, which obfuscates
-the values of specified fields in a given log message.
+the values of specified fields in a given log message, and the
+RedactionPlan class, which precompiles that work so it can be reused
+across many log records.
 """
 
+import bisect
+import hashlib
+import json
 import logging
-import re
-from typing import List, Tuple
+import logging.handlers
 import os
+import queue
+import re
+import string
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from collections.abc import Mapping
+from typing import (Any, Dict, Iterator, List, Optional, Sequence, TextIO,
+                    Tuple)
 import mysql.connector
 from mysql.connector.connection import MySQLConnection
 
 PII_FIELDS: Tuple[str, ...] = ("name", "email", "phone", "ssn", "password")
+_PLACEHOLDER = re.compile(r'%\(([^)]*)\)s')
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _any_case(pattern: str) -> str:
+    """ Makes the ASCII letters of an escaped pattern match both cases
+    """
+    return re.sub(r'[A-Za-z]', lambda m: '[{}{}]'.format(
+        m.group().lower(), m.group().upper()), pattern)
+
+
+class RedactionPlan:
+    """
+    Precompiled redaction for a fixed (fields, redaction, separator).
+
+    The field regex and its replacement are built once, so redacting a
+    message costs a single regex substitution plus the separator
+    normalisation. The output is identical to filter_datum.
+
+    render() is the structured path: it fills a "%(key)s" template with
+    the PII values already replaced, so the rendered text does not need
+    to be scanned.
+
+    Two options extend the field names beyond filter_datum:
+        - ignore_case: match field names regardless of the case of
+          their ASCII letters (other characters must match exactly)
+        - wildcards: a field ending with "*" is a prefix, e.g. "pii_*"
+          matches any key starting with "pii_" (the "*" does not span
+          "=", whitespace or the separator)
+    """
+
+    MAX_TEMPLATES = 1024
+
+    def __init__(self, fields: Sequence[str], redaction: str,
+                 separator: str, ignore_case: bool = False,
+                 wildcards: bool = False):
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        self.ignore_case = ignore_case
+        self.wildcards = wildcards
+        escape = (lambda text: _any_case(re.escape(text))) \
+            if ignore_case else re.escape
+        names = []
+        for field in self.fields:
+            if wildcards and field.endswith('*'):
+                names.append(escape(field[:-1]) + r'[^=\s' +
+                             re.escape(separator) + r']*')
+            else:
+                names.append(escape(field))
+        self._pattern = re.compile(
+            r'(' + '|'.join(names) + r')=[^' + re.escape(separator) + r']+')
+        if any('=' in field for field in self.fields):
+            # filter_datum keeps everything up to the first '=' of the
+            # match, which is shorter than the field itself here.
+            self._replacement = lambda m: \
+                m.group(1).split('=')[0] + '=' + redaction
+        else:
+            self._replacement = r'\g<1>=' + redaction.replace('\\', r'\\')
+        self._spaced_separator = separator + " "
+        self._templates = {}
+
+    @property
+    def key(self) -> tuple:
+        """ The options that define the output of the plan
+        """
+        return (self.fields, self.redaction, self.separator,
+                self.ignore_case, self.wildcards)
+
+    def substitute(self, message: str) -> str:
+        """
+        Replaces the planned field values without touching the spacing
+        around separators, e.g. to re-redact already formatted logs.
+        """
+        return self._pattern.sub(self._replacement, message)
+
+    def matched_values(self, message: str) -> List[str]:
+        """
+        Returns the field values that substitute() replaces in message.
+        """
+        return [match.group()[len(match.group(1)) + 1:]
+                for match in self._pattern.finditer(message)]
+
+    def count_matches(self, message: str) -> Dict[str, int]:
+        """
+        Counts the values of each field that redaction would replace.
+        Wildcard matches are counted under their wildcard field.
+        """
+        fold = (lambda text: text.translate(_ASCII_LOWER)) \
+            if self.ignore_case else (lambda text: text)
+        names = {}
+        for field in self.fields:
+            names.setdefault(fold(field), field)
+        counts = {}
+        for match in self._pattern.finditer(message):
+            key = fold(match.group(1))
+            field = names.get(key)
+            if field is None:
+                field = next((name for name in self.fields
+                              if name.endswith('*') and
+                              key.startswith(fold(name[:-1]))), key)
+            counts[field] = counts.get(field, 0) + 1
+        return counts
+
+    def redact(self, message: str) -> str:
+        """
+        Obfuscates the planned fields in a log message.
+        Args:
+            message (str): The log message that contains the fields.
+
+        Returns:
+            str: The redacted message, with a space added after every
+            separator except the last one.
+        """
+        return self.space(self.substitute(message))
+
+    def space(self, message: str) -> str:
+        """
+        Adds a space after every separator except the last one, the way
+        filter_datum does.
+        """
+        separator = self.separator
+        if len(separator) > 1:
+            parts = message.split(separator)
+            return self._spaced_separator.join(parts[:-1]) + \
+                separator + parts[-1]
+        head, found, tail = message.rpartition(separator)
+        if not found:
+            return separator + message
+        return head.replace(separator, self._spaced_separator) + \
+            separator + tail
+
+    def _analyse(self, template: str) -> Optional[tuple]:
+        """
+        Splits a template into literals and "%(key)s" placeholders, and
+        finds the placeholders whose value the regex would redact.
+        Returns None when the template uses other conversions, or when
+        _analyse_parts cannot tell the regex result.
+        """
+        parts = _PLACEHOLDER.split(template)
+        literals, keys = parts[0::2], parts[1::2]
+        if any('%' in literal for literal in literals):
+            return None
+        redacted = self._analyse_parts(literals)
+        return None if redacted is None else (literals, keys, redacted)
+
+    def _analyse_parts(self, literals: List[str]) -> Optional[List[bool]]:
+        """
+        Finds which of the values between literals the regex would
+        redact. Returns None when the regex result cannot be told from
+        the literals alone: a "field=" that is not directly followed by
+        a value ending at a separator, or an "=" that could complete a
+        field name started in a value.
+        """
+        if self.ignore_case or self.wildcards or not self.fields or \
+                not all(field and '=' not in field for field in self.fields):
+            return None
+        values = len(literals) - 1
+        redacted = [False] * values
+        for i, literal in enumerate(literals):
+            end = literal.find('=')
+            while end != -1:
+                before = literal[:end]
+                if any(len(field) > end and field.endswith(before)
+                       for field in self.fields):
+                    return None
+                if any(before.endswith(field) for field in self.fields):
+                    if end != len(literal) - 1 or i == values:
+                        return None
+                    following = literals[i + 1]
+                    if following[:1] not in self.separator or \
+                            not following and i + 1 < values:
+                        return None
+                    redacted[i] = True
+                end = literal.find('=', end + 1)
+        return redacted
+
+    def _cached(self, key: Any, analyse) -> Any:
+        """ Returns analyse() for key, computing it once
+        """
+        try:
+            return self._templates[key]
+        except KeyError:
+            if len(self._templates) >= self.MAX_TEMPLATES:
+                self._templates.clear()
+            analysis = self._templates[key] = analyse()
+            return analysis
+
+    def _fill(self, literals: List[str], redacted: List[bool],
+              values: Sequence[str]) -> Optional[str]:
+        """
+        Joins literals and values, replacing the redacted values.
+        Returns None when a value could change what the regex matches.
+        """
+        separator = self.separator
+        pieces = [literals[0]]
+        for value, redact, literal in zip(values, redacted, literals[1:]):
+            if redact:
+                if not value or any(char in value for char in separator):
+                    return None
+                value = self.redaction
+            elif '=' in value:
+                return None
+            pieces.append(value)
+            pieces.append(literal)
+        return "".join(pieces)
+
+    def render(self, template: str, args: Mapping) -> Optional[str]:
+        """
+        Renders template % args with the PII values already redacted.
+        Args:
+            template (str): A message made of literals and "%(key)s"
+            placeholders.
+            args (Mapping): The values of the placeholders.
+
+        Returns:
+            str: The same text as redacting the rendered message, before
+            separator spacing, or None when that cannot be guaranteed
+            for these values and the regex path must be used.
+        """
+        analysis = self._cached(template,
+                                lambda: self._analyse(template))
+        if analysis is None:
+            return None
+        literals, keys, redacted = analysis
+        try:
+            values = [str(args[key]) for key in keys]
+        except KeyError:
+            return None
+        return self._fill(literals, redacted, values)
+
+    def redacted_keys(self, template: str) -> Optional[List[str]]:
+        """
+        Returns the keys of the placeholders of template whose value
+        render() replaces, or None when render() cannot use template.
+        """
+        analysis = self._cached(template,
+                                lambda: self._analyse(template))
+        if analysis is None:
+            return None
+        _, keys, redacted = analysis
+        return [key for key, redact in zip(keys, redacted) if redact]
+
+    def redact_rows(self, columns: Sequence[str],
+                    rows: Sequence[Sequence[Any]]) -> List[str]:
+        """
+        Renders a batch of rows as "column=value;" messages, with the
+        values of PII columns replaced.
+        Args:
+            columns (Sequence[str]): The column names of the rows.
+            rows (Sequence[Sequence]): The rows, as fetched.
+
+        Returns:
+            List[str]: One message per row, identical to substitute()
+            on the rendered row. The columns are analysed once per
+            batch; a row whose values could change the regex result
+            is rendered and scanned instead.
+        """
+        columns = tuple(columns)
+        if not columns:
+            return ["" for _ in rows]
+        separator = self.separator
+        literals = [columns[0] + '='] + \
+            [separator + column + '=' for column in columns[1:]] + \
+            [separator]
+        redacted = self._cached(("rows", columns),
+                                lambda: self._analyse_parts(literals))
+        messages = []
+        for row in rows:
+            values = [str(value) for value in row]
+            message = None
+            if redacted is not None:
+                message = self._fill(literals, redacted, values)
+            if message is None:
+                pieces = [literals[0]]
+                for value, literal in zip(values, literals[1:]):
+                    pieces.append(value)
+                    pieces.append(literal)
+                message = self.substitute("".join(pieces))
+            messages.append(message)
+        return messages
+
+
+class TrieRedactionPlan(RedactionPlan):
+    """
+    RedactionPlan that finds fields without a regex alternation.
+
+    The message is scanned for "=" and, for each one, the text before it
+    is walked backwards through a trie of the reversed field names, so
+    the cost per "=" depends on the length of the longest field rather
+    than on the number of fields. Wildcard fields are looked up in the
+    key before the "=" and still cost one search each.
+    The output is identical to RedactionPlan with the same options.
+    """
+
+    def __init__(self, fields: Sequence[str], redaction: str,
+                 separator: str, ignore_case: bool = False,
+                 wildcards: bool = False):
+        super().__init__(fields, redaction, separator, ignore_case,
+                         wildcards)
+        # Fields containing "=" keep the regex, see RedactionPlan.
+        self._use_regex = any('=' in field for field in self.fields)
+        self._stops = frozenset(separator)
+        self._key_stops = frozenset(separator + '=')
+        self._prefixes = []
+        self._trie = {}
+        if not self.fields:
+            self._trie[''] = True
+        for field in self.fields:
+            if ignore_case:
+                field = field.translate(_ASCII_LOWER)
+            if wildcards and field.endswith('*'):
+                self._prefixes.append(field[:-1])
+                continue
+            node = self._trie
+            for char in reversed(field):
+                child = node.setdefault(char, {})
+                if ignore_case and char in string.ascii_lowercase:
+                    # Both cases of a letter lead to the same node
+                    node[char.upper()] = child
+                node = child
+            node[''] = True
+
+    def _ends_with_field(self, message: str, start: int, end: int) -> bool:
+        """
+        Whether a field ends at message[end], starting at start or later.
+        """
+        node = self._trie
+        index = end
+        while '' not in node:
+            index -= 1
+            if index < start:
+                break
+            node = node.get(message[index])
+            if node is None:
+                break
+        else:
+            return True
+        if not self._prefixes:
+            return False
+        key_start = end
+        while key_start > start and \
+                message[key_start - 1] not in self._key_stops and \
+                not message[key_start - 1].isspace():
+            key_start -= 1
+        for prefix in self._prefixes:
+            low = max(start, key_start - len(prefix))
+            text = message[low:end]
+            if self.ignore_case:
+                text = text.translate(_ASCII_LOWER)
+            if prefix in text and \
+                    text.rfind(prefix) + len(prefix) + low >= key_start:
+                return True
+        return False
+
+    def _value_end(self, message: str, start: int) -> int:
+        """
+        Index of the first separator character from start on.
+        """
+        ends = [message.find(char, start) for char in self._stops]
+        ends = [end for end in ends if end != -1]
+        return min(ends) if ends else len(message)
+
+    def substitute(self, message: str) -> str:
+        """
+        Replaces the planned field values without touching the spacing
+        around separators.
+        """
+        if self._use_regex:
+            return super().substitute(message)
+        stops = self._stops
+        length = len(message)
+        pieces = []
+        position = 0
+        equal = message.find('=')
+        while equal != -1:
+            value = equal + 1
+            if value < length and message[value] not in stops and \
+                    self._ends_with_field(message, position, equal):
+                pieces.append(message[position:value])
+                pieces.append(self.redaction)
+                position = self._value_end(message, value)
+                equal = message.find('=', position)
+            else:
+                equal = message.find('=', value)
+        if not pieces:
+            return message
+        pieces.append(message[position:])
+        return "".join(pieces)
+
+
+@lru_cache(maxsize=32)
+def _redaction_plan(fields: Tuple[str, ...], redaction: str,
+                    separator: str) -> RedactionPlan:
+    """ Returns a shared RedactionPlan for the given arguments
+    """
+    return RedactionPlan(fields, redaction, separator)
 
 
 def filter_datum(fields: List[str], redaction: str,
@@ -32,14 +444,189 @@ def filter_datum(fields: List[str], redaction: str,
         str: The log message with sensitive field values replaced
         by the redaction string.
     """
-    obfuscated_message = re.sub(
-        r'(' + '|'.join([re.escape(field) for field in fields
-                         ]) + r')=[^' + re.escape(separator) + r']+',
-        lambda m: m.group(0).split('=')[0] + '=' + redaction,
-        message
-    )
-    parts = obfuscated_message.split(separator)
-    return f"{separator} ".join(parts[:-1]) + separator + parts[-1]
+    plan = _redaction_plan(tuple(fields), redaction, separator)
+    if _stats is None:
+        return plan.redact(message)
+    start = time.perf_counter_ns()
+    redacted = plan.redact(message)
+    _stats.add(plan.count_matches(message), message, redacted,
+               time.perf_counter_ns() - start)
+    return redacted
+
+
+class RedactionStats:
+    """
+    Counters of the redaction layer, fed by filter_datum and
+    RedactingFormatter while instrumentation is enabled:
+        - records: number of messages redacted
+        - matches: number of values replaced, per field
+        - bytes_in / bytes_out: UTF-8 size of the messages before and
+          after redaction (the message alone for RedactingFormatter, not
+          the formatted line)
+        - time_ns: cumulative redaction time, also counted in a
+          histogram of microsecond buckets
+    """
+
+    BUCKETS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Sets every counter back to zero
+        """
+        with self._lock:
+            self.records = 0
+            self.matches = {}
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.time_ns = 0
+            self.histogram = [0] * (len(self.BUCKETS_US) + 1)
+
+    def add(self, matches: Dict[str, int], message: str, redacted: str,
+            elapsed_ns: int):
+        """ Records one redacted message
+        """
+        bucket = bisect.bisect_left(self.BUCKETS_US, elapsed_ns / 1000)
+        size_in = len(message.encode("utf-8", "surrogatepass"))
+        size_out = len(redacted.encode("utf-8", "surrogatepass"))
+        with self._lock:
+            self.records += 1
+            for field, count in matches.items():
+                self.matches[field] = self.matches.get(field, 0) + count
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+            self.time_ns += elapsed_ns
+            self.histogram[bucket] += 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns a consistent copy of the counters. The histogram maps
+        "<=N" (microseconds) to a number of records, plus ">N" for the
+        slowest ones.
+        """
+        with self._lock:
+            histogram = {"<={}".format(bound): count for bound, count
+                         in zip(self.BUCKETS_US, self.histogram)}
+            histogram[">{}".format(self.BUCKETS_US[-1])] = \
+                self.histogram[-1]
+            return {
+                "records": self.records,
+                "matches": dict(self.matches),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "time_ns": self.time_ns,
+                "histogram_us": histogram,
+            }
+
+
+_stats: Optional[RedactionStats] = None
+
+
+def enable_redaction_stats() -> RedactionStats:
+    """
+    Starts instrumenting filter_datum and RedactingFormatter.
+    While disabled, the only cost is a check of a module variable.
+
+    Returns:
+        RedactionStats: The counters, kept when already enabled.
+    """
+    global _stats
+    if _stats is None:
+        _stats = RedactionStats()
+    return _stats
+
+
+def disable_redaction_stats():
+    """ Stops instrumenting the redaction and drops the counters
+    """
+    global _stats
+    _stats = None
+
+
+def redaction_stats() -> Optional[dict]:
+    """
+    Returns a snapshot of the redaction counters, or None when the
+    instrumentation is disabled.
+    """
+    stats = _stats
+    return None if stats is None else stats.snapshot()
+
+
+class RedactionCache:
+    """
+    Bounded LRU cache of redacted messages.
+
+    Entries are keyed on a BLAKE2 digest of the message and hold only
+    the redacted text, so the cache never keeps unredacted data alive.
+    Safe to share between threads.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(message: str) -> bytes:
+        """ Returns the cache key of a message
+        """
+        return hashlib.blake2b(message.encode("utf-8", "surrogatepass"),
+                               digest_size=16).digest()
+
+    def get(self, message: str, redact) -> str:
+        """
+        Returns the redacted message, calling redact(message) on a miss.
+        """
+        key = self.key(message)
+        with self._lock:
+            redacted = self._entries.get(key)
+            if redacted is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return redacted
+            self.misses += 1
+        redacted = redact(message)
+        with self._lock:
+            self._entries[key] = redacted
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return redacted
+
+    def cache_info(self) -> CacheInfo:
+        """ Returns the hit and miss counters and the size of the cache
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._entries))
+
+    def clear(self):
+        """ Empties the cache and resets its counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+# First item of the redacted_by attribute that export_users attaches to
+# the records it has already redacted. It is private, so that other
+# records cannot claim to be redacted.
+_PRE_REDACTED = object()
+
+
+def _pre_redacted(record: logging.LogRecord, plan: RedactionPlan) -> bool:
+    """
+    Whether export_users already redacted the message of a record with
+    the options of plan.
+    """
+    redacted_by = getattr(record, "redacted_by", None)
+    return type(redacted_by) is tuple and len(redacted_by) == 2 and \
+        redacted_by[0] is _PRE_REDACTED and redacted_by[1] == plan.key
 
 
 class RedactingFormatter(logging.Formatter):
@@ -49,27 +636,488 @@ class RedactingFormatter(logging.Formatter):
     REDACTION = "***"
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
+    MATCHERS = {"regex": RedactionPlan, "trie": TrieRedactionPlan}
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], matcher: str = "regex",
+                 ignore_case: bool = False, wildcards: bool = False,
+                 cache_size: int = 0):
+        """
+        Args:
+            fields (List[str]): The field names to be obfuscated.
+            matcher (str): "regex", or "trie" for long field lists.
+            ignore_case (bool): Match the ASCII letters of field names
+            regardless of case.
+            wildcards (bool): Treat fields ending with "*" as prefixes.
+            cache_size (int): Number of redacted messages to memoise,
+            so that repeated messages are not scanned again. 0 disables
+            the cache.
+        """
+        if matcher not in self.MATCHERS:
+            raise ValueError("matcher must be one of {}".format(
+                ", ".join(self.MATCHERS)))
         super().__init__(self.FORMAT)
         self.fields = fields
+        self.plan = self.MATCHERS[matcher](fields, self.REDACTION,
+                                           self.SEPARATOR, ignore_case,
+                                           wildcards)
+        # The structured path needs the message to be the last and only
+        # place of the format where an "=" can appear.
+        self.structured = self._fmt.endswith("%(message)s") and \
+            '=' not in self._fmt and \
+            (self.datefmt is None or '=' not in self.datefmt)
+        # Messages can be redacted on their own, and thus memoised or
+        # redacted in advance, when no field can start before the
+        # message: the format puts a space there and no field contains
+        # one.
+        self.isolated = self.structured and \
+            self._fmt.endswith(" %(message)s") and \
+            not any(char.isspace() for field in fields for char in field)
+        self.cache = None
+        if cache_size and self.isolated:
+            self.cache = RedactionCache(cache_size)
 
     def format(self, record: logging.LogRecord) -> str:
         """
         Format the log message, obfuscating sensitive fields.
+        Feeds the redaction counters when they are enabled, measuring
+        the message like filter_datum does; the values of messages
+        already redacted by export_users are not counted again.
         """
+        stats = _stats
+        if stats is None:
+            return self._format(record)
+        start = time.perf_counter_ns()
+        formatted = self._format(record)
+        elapsed = time.perf_counter_ns() - start
+        message = record.getMessage()
+        if _pre_redacted(record, self.plan):
+            stats.add({}, message, message, elapsed)
+        else:
+            stats.add(self.plan.count_matches(message), message,
+                      self.plan.redact(message), elapsed)
+        return formatted
+
+    def _format(self, record: logging.LogRecord) -> str:
+        """
+        Format the log message, obfuscating sensitive fields.
+        Messages logged with mapping args are redacted by key before
+        rendering when possible, messages already redacted with the
+        same plan by export_users are used as is, and repeated messages are
+        taken from the cache when enabled; others are rendered, then
+        redacted.
+        """
+        if self.structured and \
+                not (record.exc_info or record.exc_text or
+                     record.stack_info) and \
+                '=' not in record.name and '=' not in record.levelname:
+            message = None
+            if self.isolated and _pre_redacted(record, self.plan):
+                message = record.getMessage()
+            elif isinstance(record.args, Mapping):
+                message = self.plan.render(str(record.msg), record.args)
+            if message is None and self.cache is not None:
+                message = self.cache.get(record.getMessage(),
+                                         self.plan.substitute)
+            if message is not None:
+                record.message = message
+                if self.usesTime():
+                    record.asctime = self.formatTime(record, self.datefmt)
+                return self.plan.space(self.formatMessage(record))
         original_message = super().format(record)
-        return filter_datum(self.fields, self.REDACTION,
-                            original_message, self.SEPARATOR)
+        return self.plan.redact(original_message)
+
+
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord(
+    "", logging.INFO, "", 0, "", None, None))) | \
+    {"message", "asctime", "redacted_by"}
+
 
+class JsonRedactingFormatter(logging.Formatter):
+    """ JSON lines formatter that redacts PII fields by key
 
-def get_logger() -> logging.Logger:
+    Each record becomes one JSON object:
+        {"time": ..., "name": ..., "level": ..., "message": ...,
+         "data": {...}, "extra": {...}, "exception": ...}
+    The message is redacted like RedactingFormatter does: by key while
+    rendering mapping args when possible, otherwise by the field regex,
+    as are the exception text and the stack. The values it puts in PII
+    fields are then hidden everywhere else in the record:
+        - "data" holds the mapping args, only when the message was
+          rendered by key, and "extra" the attributes given with
+          extra=; the values of PII keys are replaced at any depth, as
+          are the values that contain one of the message
+        - the exception text and the stack have those values replaced
+        - a payload that still contains one of them once serialised,
+          e.g. in a key or an object, is replaced as a whole
+    """
+
+    REDACTION = RedactingFormatter.REDACTION
+    SEPARATOR = RedactingFormatter.SEPARATOR
+    ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"),
+                               default=str)
+
+    def __init__(self, fields: Sequence[str]):
+        super().__init__()
+        self.fields = fields
+        self.keys = frozenset(fields)
+        self.plan = RedactionPlan(fields, self.REDACTION, self.SEPARATOR)
+
+    def redact_value(self, value: Any, secrets: Sequence[str] = ()) -> Any:
+        """
+        Returns value with the values of PII keys replaced, looking into
+        nested mappings, lists and tuples, as well as the strings that
+        contain one of secrets and the values whose text is one.
+        """
+        if isinstance(value, Mapping):
+            return {key: self.REDACTION if key in self.keys
+                    else self.redact_value(item, secrets)
+                    for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.redact_value(item, secrets) for item in value]
+        if secrets:
+            if isinstance(value, str):
+                if any(secret in value for secret in secrets):
+                    return self.REDACTION
+            elif value is not None and str(value) in secrets:
+                return self.REDACTION
+        return value
+
+    def redact_text(self, text: str, secrets: Sequence[str]) -> str:
+        """
+        Returns text redacted by the field regex, with every occurrence
+        of secrets replaced.
+        """
+        text = self.plan.substitute(text)
+        for secret in secrets:
+            text = text.replace(secret, self.REDACTION)
+        return text
+
+    def _leaks(self, value: Any, secrets: Sequence[str]) -> bool:
+        """ Whether the JSON of value contains one of secrets
+        """
+        text = self.ENCODER.encode(value)
+        return any(self.ENCODER.encode(secret)[1:-1] in text
+                   for secret in secrets)
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Serialise the record as one line of JSON, obfuscating PII keys.
+        """
+        document = {
+            "time": self.formatTime(record, self.datefmt),
+            "name": record.name,
+            "level": record.levelname,
+        }
+        message = None
+        data = isinstance(record.args, Mapping)
+        secrets = set()
+        if _pre_redacted(record, self.plan):
+            message = record.getMessage()
+        elif data:
+            template = str(record.msg)
+            message = self.plan.render(template, record.args)
+            if message is not None:
+                secrets.update(str(record.args[key]) for key
+                               in self.plan.redacted_keys(template))
+        if message is None:
+            # The args cannot be told apart from what the regex matched
+            data = False
+            rendered = record.getMessage()
+            message = self.plan.substitute(rendered)
+            secrets.update(self.plan.matched_values(rendered))
+        secrets = sorted(secrets - {""}, key=len, reverse=True)
+        document["message"] = message
+        if data:
+            document["data"] = self.redact_value(record.args, secrets)
+        extra = {key: value for key, value in vars(record).items()
+                 if key not in _RECORD_ATTRIBUTES}
+        if extra:
+            document["extra"] = self.redact_value(extra, secrets)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            document["exception"] = self.redact_text(record.exc_text,
+                                                     secrets)
+        if record.stack_info:
+            document["stack"] = self.redact_text(
+                self.formatStack(record.stack_info), secrets)
+        if secrets:
+            for key in ("data", "extra", "exception", "stack"):
+                if key in document and self._leaks(document[key], secrets):
+                    document[key] = self.REDACTION
+        return self.ENCODER.encode(document)
+
+
+class RedactingQueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler that redacts and writes records on a worker thread
+
+    The logging thread only puts records on a bounded queue. When the
+    queue is full, when_full decides what happens to a record:
+        - "block": wait for room in the queue
+        - "drop": drop the record
+        - "sample": keep one record in sample_rate, drop the others
+    The worker formats records in batches of up to batch_size and writes
+    each batch to the stream with a single write. flush() waits for the
+    queued records to be written; logging.shutdown() flushes and closes
+    the handler at exit.
+    """
+
+    POLICIES = ("block", "drop", "sample")
+
+    def __init__(self, formatter: logging.Formatter,
+                 stream: TextIO = None, maxsize: int = 10000,
+                 when_full: str = "block", batch_size: int = 100,
+                 sample_rate: int = 10):
+        if when_full not in self.POLICIES:
+            raise ValueError("when_full must be one of {}".format(
+                ", ".join(self.POLICIES)))
+        super().__init__(queue.Queue(maxsize))
+        self.when_full = when_full
+        self.batch_size = max(1, batch_size)
+        self.sample_rate = max(1, sample_rate)
+        self.dropped = 0
+        self._overflows = 0
+        self.target = logging.StreamHandler(stream)
+        self.target.setFormatter(formatter)
+        self._worker = threading.Thread(target=self._drain,
+                                        name="user_data-redaction",
+                                        daemon=True)
+        self._worker.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Leaves formatting and redaction to the worker thread.
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """
+        Puts a record on the queue according to the when_full policy.
+        """
+        if self.when_full == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            self._overflows += 1
+        if self.when_full == "sample" and \
+                self._overflows % self.sample_rate == 0:
+            self.queue.put(record)
+        else:
+            self.dropped += 1
+
+    def _drain(self):
+        """
+        Worker loop: writes batches of records until the stop sentinel.
+        """
+        records_queue = self.queue
+        while True:
+            batch = [records_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(records_queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not None]
+            if records:
+                self._write(records)
+            for _ in batch:
+                records_queue.task_done()
+            if len(records) < len(batch):
+                return
+
+    def _write(self, records: List[logging.LogRecord]):
+        """
+        Formats records and writes them to the stream at once.
+        """
+        target = self.target
+        lines = []
+        for record in records:
+            try:
+                lines.append(target.format(record) + target.terminator)
+            except Exception:
+                target.handleError(record)
+        target.acquire()
+        try:
+            target.stream.write("".join(lines))
+            target.flush()
+        except Exception:
+            target.handleError(records[-1])
+        finally:
+            target.release()
+
+    def flush(self):
+        """
+        Waits until every queued record has been written.
+        """
+        if self._worker.is_alive():
+            self.queue.join()
+
+    def close(self):
+        """
+        Writes the remaining records and stops the worker.
+        """
+        if self._worker.is_alive():
+            self.queue.put(None)
+            self._worker.join()
+        self.target.close()
+        super().close()
+
+
+class BufferedRedactingHandler(logging.StreamHandler):
+    """ Stream handler that writes records in batches
+
+    Formatted records are buffered and written when the buffer holds
+    max_bytes (encoded for the stream) or max_records, every interval
+    seconds, on a record of flush_level or above, and on flush() or
+    close() (logging.shutdown() calls both at exit). When the stream has
+    a file descriptor, a batch goes out with os.writev, one system call
+    for up to IOV_MAX records.
+    """
+
+    IOV_MAX = 1024
+
+    def __init__(self, stream: TextIO = None, max_bytes: int = 65536,
+                 max_records: int = 256, interval: float = 1.0,
+                 flush_level: int = logging.ERROR):
+        super().__init__(stream)
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.interval = interval
+        self.flush_level = flush_level
+        self.writes = 0
+        self._buffer = []
+        self._chunks = []
+        self._size = 0
+        self._stop = threading.Event()
+        self._timer = None
+        if interval:
+            self._timer = threading.Thread(target=self._flush_periodically,
+                                           name="user_data-flush",
+                                           daemon=True)
+            self._timer.start()
+
+    def _flush_periodically(self):
+        """ Timer loop: flushes the buffer every interval seconds
+        """
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def _encoding(self) -> str:
+        """ Encoding of the stream, for writes to its descriptor
+        """
+        return getattr(self.stream, "encoding", None) or "utf-8"
+
+    def emit(self, record: logging.LogRecord):
+        """
+        Buffers a formatted record, flushing when a limit is reached.
+        """
+        try:
+            line = self.format(record) + self.terminator
+            chunk = line.encode(self._encoding(), "backslashreplace")
+        except Exception:
+            self.handleError(record)
+            return
+        self._buffer.append(line)
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        if self._size >= self.max_bytes or \
+                len(self._buffer) >= self.max_records or \
+                record.levelno >= self.flush_level:
+            self.flush()
+
+    def _write_fd(self, fd: int, chunks: List[bytes]):
+        """ Writes encoded lines to a file descriptor with vectored writes
+        """
+        chunks = list(chunks)
+        while chunks:
+            batch = chunks[:self.IOV_MAX]
+            written = os.writev(fd, batch)
+            self.writes += 1
+            total = sum(len(chunk) for chunk in batch)
+            if written == total:
+                del chunks[:len(batch)]
+                continue
+            # Partial write: drop what went out and retry the rest.
+            for index, chunk in enumerate(batch):
+                if written < len(chunk):
+                    chunks[:index + 1] = [chunk[written:]]
+                    break
+                written -= len(chunk)
+
+    def flush(self):
+        """
+        Writes the buffered records to the stream.
+        """
+        self.acquire()
+        try:
+            lines, chunks = self._buffer, self._chunks
+            self._buffer, self._chunks, self._size = [], [], 0
+            stream = self.stream
+            if not lines or stream is None:
+                if stream is not None and hasattr(stream, "flush"):
+                    stream.flush()
+                return
+            try:
+                fd = stream.fileno() if hasattr(os, "writev") else None
+            except (AttributeError, OSError, ValueError):
+                fd = None
+            try:
+                if fd is None:
+                    stream.write("".join(lines))
+                    stream.flush()
+                    self.writes += 1
+                else:
+                    # Keep the order of what was written to the stream.
+                    stream.flush()
+                    self._write_fd(fd, chunks)
+            except Exception:
+                self.handleError(logging.makeLogRecord(
+                    {"msg": "Failed to write %d buffered records",
+                     "args": (len(lines),)}))
+        finally:
+            self.release()
+
+    def close(self):
+        """
+        Stops the timer and writes the remaining records.
+        """
+        self._stop.set()
+        if self._timer is not None and \
+                self._timer is not threading.current_thread():
+            self._timer.join()
+        self.flush()
+        super().close()
+
+
+def get_logger(queued: bool = False, maxsize: int = 10000,
+               when_full: str = "block", batch_size: int = 100,
+               json_lines: bool = False,
+               buffered: bool = False) -> logging.Logger:
     """
     Creates and configures a logger named "user_data".
     The logger will only log up to INFO level, and it will not propagate
     messages to other loggers. It includes a StreamHandler with
     a RedactingFormatter to filter sensitive information.
 
+    Args:
+        queued (bool): Use a RedactingQueueHandler instead, so that
+        redaction and I/O run on a background thread.
+        maxsize (int): Size of the queue in queued mode.
+        when_full (str): What to do with records when the queue is full.
+        batch_size (int): Maximum number of records written at once.
+        json_lines (bool): Use a JsonRedactingFormatter instead of the
+        RedactingFormatter.
+        buffered (bool): Write through a BufferedRedactingHandler, which
+        batches records instead of writing them one by one. Ignored in
+        queued mode, whose worker already writes in batches.
+
+    Calling get_logger() again with the same arguments returns the
+    logger unchanged; with different arguments, the previous handler is
+    closed and replaced.
+
     Returns:
         logging.Logger: Configured logger instance.
     """
@@ -77,9 +1125,34 @@ def get_logger() -> logging.Logger:
     logger.setLevel(logging.INFO)
     logger.propagate = False
 
-    handler = logging.StreamHandler()
-    handler.setFormatter(RedactingFormatter(fields=PII_FIELDS))
+    options = (json_lines, queued) + \
+        ((maxsize, when_full, batch_size) if queued else (buffered,))
+    previous = [handler for handler in logger.handlers
+                if hasattr(handler, "get_logger_options")]
+    if any(handler.get_logger_options == options for handler in previous):
+        return logger
+
+    # The previous handler is replaced only once the new one is built, so
+    # that invalid options never leave the logger without redaction.
+    if json_lines:
+        formatter = JsonRedactingFormatter(fields=PII_FIELDS)
+    else:
+        formatter = RedactingFormatter(fields=PII_FIELDS)
+    if queued:
+        handler = RedactingQueueHandler(formatter, maxsize=maxsize,
+                                        when_full=when_full,
+                                        batch_size=batch_size)
+    elif buffered:
+        handler = BufferedRedactingHandler()
+        handler.setFormatter(formatter)
+    else:
+        handler = logging.StreamHandler()
+        handler.setFormatter(formatter)
+    handler.get_logger_options = options
     logger.addHandler(handler)
+    for old_handler in previous:
+        logger.removeHandler(old_handler)
+        old_handler.close()
 
     return logger
 
@@ -112,3 +1185,78 @@ def get_db() -> MySQLConnection:
         host=host,
         database=database
     )
+
+
+def iter_batches(cursor: Any, batch_size: int = 1000) -> Iterator[list]:
+    """
+    Yields the rows of an executed cursor in batches of batch_size.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def iter_rows(cursor: Any, batch_size: int = 1000) -> Iterator[tuple]:
+    """
+    Yields the rows of an executed cursor, fetching batch_size at a time,
+    so only one batch is held in memory.
+    """
+    for rows in iter_batches(cursor, batch_size):
+        yield from rows
+
+
+def export_users(db: Any = None, logger: logging.Logger = None,
+                 batch_size: int = 1000) -> int:
+    """
+    Logs every row of the users table as "column=value;" pairs.
+    Each fetched batch is redacted column-wise by
+    RedactionPlan.redact_rows before it is logged, so that the
+    RedactingFormatter of get_logger() does not scan the messages again.
+    Args:
+        db: A DB-API connection, get_db() when None. It is closed only
+        when it was opened here.
+        logger (logging.Logger): The logger, get_logger() when None.
+        batch_size (int): Number of rows fetched at once.
+
+    Returns:
+        int: The number of rows logged.
+    """
+    own_db = db is None
+    if own_db:
+        db = get_db()
+    if logger is None:
+        logger = get_logger()
+    cursor = db.cursor()
+    count = 0
+    try:
+        cursor.execute("SELECT * FROM users;")
+        columns = [column[0] for column in cursor.description]
+        plan = _redaction_plan(tuple(PII_FIELDS),
+                               RedactingFormatter.REDACTION,
+                               RedactingFormatter.SEPARATOR)
+        extra = {"redacted_by": (_PRE_REDACTED, plan.key)}
+        for rows in iter_batches(cursor, batch_size):
+            count += len(rows)
+            if not logger.isEnabledFor(logging.INFO):
+                continue
+            for message in plan.redact_rows(columns, rows):
+                logger.info(message, extra=extra)
+    finally:
+        cursor.close()
+        if own_db:
+            db.close()
+    return count
+
+
+def main():
+    """
+    Obtains a database connection and logs every row of the users table
+    in a filtered format.
+    """
+    export_users()
+
+
+if __name__ == "__main__":
+    main()
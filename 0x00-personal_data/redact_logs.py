@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+
+"""
+Module for re-redacting archived log files.
+
+Log files can be much larger than memory, so they are read through
+mmap in line-aligned chunks and redacted chunk by chunk, optionally
+on a pool of worker processes. Lines are always yielded in their
+original order.
+
+Usage:
+    ./redact_logs.py [-f FIELD ...] [-p PROCESSES] [-o OUTPUT] [FILE ...]
+"""
+
+import argparse
+import mmap
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Iterable, Iterator, List, Sequence, Tuple, Union
+
+from filtered_logger import PII_FIELDS, RedactionPlan, _redaction_plan
+
+CHUNK_SIZE = 1 << 20
+ENCODING = "utf-8"
+ERRORS = "surrogateescape"
+
+Source = Union[str, os.PathLike, Iterable[str]]
+
+
+def iter_chunks(file_path: Union[str, os.PathLike],
+                chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yields the content of a file in chunks that end on a line boundary.
+    Args:
+        file_path: The file to read.
+        chunk_size (int): The target size of a chunk in bytes. A chunk
+        grows past it only to finish its last line.
+
+    Returns:
+        Iterator[bytes]: The chunks, in file order.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < size:
+                end = start + chunk_size
+                if end < size:
+                    newline = mm.find(b'\n', end - 1)
+                    end = size if newline == -1 else newline + 1
+                else:
+                    end = size
+                yield mm[start:end]
+                start = end
+
+
+def redact_line(plan: RedactionPlan, line: str) -> str:
+    """
+    Redacts one line, leaving its line ending untouched.
+    """
+    if line.endswith('\r\n'):
+        return plan.substitute(line[:-2]) + '\r\n'
+    if line.endswith('\n') or line.endswith('\r'):
+        return plan.substitute(line[:-1]) + line[-1]
+    return plan.substitute(line)
+
+
+def redact_chunk(chunk: bytes, fields: Tuple[str, ...], redaction: str,
+                 separator: str) -> List[str]:
+    """
+    Redacts every line of a chunk read by iter_chunks.
+    Module level so that it can run in a worker process.
+    """
+    plan = _redaction_plan(fields, redaction, separator)
+    lines = chunk.decode(ENCODING, ERRORS).split('\n')
+    last = lines.pop()
+    redacted = [redact_line(plan, line + '\n') for line in lines]
+    if last:
+        redacted.append(redact_line(plan, last))
+    return redacted
+
+
+def redact_stream(source: Source, fields: Sequence[str] = PII_FIELDS,
+                  redaction: str = "***", separator: str = ";",
+                  chunk_size: int = CHUNK_SIZE,
+                  processes: int = None) -> Iterator[str]:
+    """
+    Redacts a log file or an iterable of lines.
+    Args:
+        source: A file path, or an iterable of lines such as an open
+        text file.
+        fields (Sequence[str]): The field names to be obfuscated.
+        redaction (str): The string to replace the field values with.
+        separator (str): The separator character between fields.
+        chunk_size (int): The size of the chunks a file is read in.
+        processes (int): The number of worker processes used to redact
+        the chunks of a file. Runs in the current process when None.
+
+    Returns:
+        Iterator[str]: The redacted lines with their line endings, in
+        their original order.
+
+    Only the field values are replaced: the lines are expected to come
+    from a RedactingFormatter, so their separators are already spaced.
+    At most two chunks per worker are in flight, so memory use does not
+    depend on the size of the file.
+    """
+    fields = tuple(fields)
+    if not isinstance(source, (str, bytes, os.PathLike)):
+        plan = _redaction_plan(fields, redaction, separator)
+        for line in source:
+            yield redact_line(plan, line)
+        return
+
+    chunks = iter_chunks(source, chunk_size)
+    if not processes:
+        for chunk in chunks:
+            yield from redact_chunk(chunk, fields, redaction, separator)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(redact_chunk, chunk, fields,
+                                           redaction, separator))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def redact_file(source: Source, output: IO[str], **kwargs) -> int:
+    """
+    Writes the redacted lines of source to output.
+    Takes the same keyword arguments as redact_stream.
+
+    Returns:
+        int: The number of lines written.
+    """
+    count = 0
+    for line in redact_stream(source, **kwargs):
+        output.write(line)
+        count += 1
+    return count
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Redact PII fields in log files.")
+    parser.add_argument('files', nargs='*', default=['-'],
+                        help="log files to redact, '-' for stdin")
+    parser.add_argument('-f', '--field', dest='fields', action='append',
+                        help="field to redact (default: PII_FIELDS)")
+    parser.add_argument('-r', '--redaction', default="***")
+    parser.add_argument('-s', '--separator', default=";")
+    parser.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('-p', '--processes', type=int, default=None)
+    parser.add_argument('-o', '--output', default='-',
+                        help="output file, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    options = {
+        'fields': args.fields or PII_FIELDS,
+        'redaction': args.redaction,
+        'separator': args.separator,
+        'chunk_size': args.chunk_size,
+        'processes': args.processes,
+    }
+    if args.output == '-':
+        output = sys.stdout
+    else:
+        output = open(args.output, 'w', encoding=ENCODING, errors=ERRORS,
+                      newline='')
+    try:
+        for file_path in args.files:
+            if file_path == '-':
+                redact_file(sys.stdin, output, **options)
+            else:
+                redact_file(file_path, output, **options)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
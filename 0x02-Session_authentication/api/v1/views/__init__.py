@@ -9,3 +9,10 @@ from api.v1.views.index import *
 from api.v1.views.users import *
 
 User.load_from_file()
+
+
+@app_views.before_app_request
+def refresh_users():
+    """ Apply the changes other workers made to the users
+    """
+    User.refresh()
@@ -1,19 +1,118 @@
 #!/usr/bin/env python3
 """ Module of Users views
 """
+from typing import Optional
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import abort, jsonify, request, url_for
+from models.base import parse_timestamp
 from models.user import User
 
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+SEARCH_EQUALS = ('email', 'first_name', 'last_name')
+SEARCH_PREFIXES = ('email', 'last_name')
+SEARCH_RANGES = {'created': 'created_at', 'updated': 'updated_at'}
+SEARCH_ORDERS = ('id', 'email', 'last_name', 'created_at', 'updated_at')
+
+
+def _limit() -> Optional[int]:
+    """ limit query parameter, None if not valid
+    """
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+    except ValueError:
+        return None
+    return limit if 0 < limit <= MAX_PAGE_SIZE else None
+
+
+def _bad_request(message: str) -> tuple:
+    """ 400 response with an error message
+    """
+    return jsonify({'error': message}), 400
+
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters:
+      - limit (optional): number of users per page (default: 100, at
+        most 1000)
+      - after (optional): ID of the last User of the previous page
+      - all (optional): "true" to get all the users at once, unpaginated
+    Return:
+      - list of User objects JSON represented, by ID, with a Link header
+        to the next page if there is one
+      - 400 if limit is not valid
+    """
+    if request.args.get('all') == "true":
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+    limit = _limit()
+    if limit is None:
+        return _bad_request("limit must be an integer between 1 and "
+                            "{}".format(MAX_PAGE_SIZE))
+    users = User.all(limit=limit + 1, after=request.args.get('after'))
+    response = jsonify([user.to_json() for user in users[:limit]])
+    if len(users) > limit:
+        response.headers['Link'] = '<{}>; rel="next"'.format(url_for(
+            'app_views.view_all_users', limit=limit,
+            after=users[limit - 1].id, _external=True))
+    return response
+
+
+@app_views.route('/users/search', methods=['GET'], strict_slashes=False)
+def search_users() -> str:
+    """ GET /api/v1/users/search
+    Query parameters (all optional):
+      - email, first_name, last_name: exact values
+      - email_prefix, last_name_prefix: beginning of the value, in any
+        case
+      - created_after, created_before, updated_after, updated_before:
+        timestamps (2024-01-31T23:59:59, UTC), after included, before
+        excluded
+      - order_by: id (default), email, last_name, created_at or
+        updated_at
+      - order: asc (default) or desc
+      - limit: number of users (default: 100, at most 1000)
     Return:
-      - list of all User objects JSON represented
+      - list of the matching User objects JSON represented, in order
+      - 400 if a parameter is not valid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    args = request.args
+    attributes = {name: args[name] for name in SEARCH_EQUALS
+                  if name in args}
+    prefixes = {name: args[name + '_prefix'] for name in SEARCH_PREFIXES
+                if name + '_prefix' in args}
+    ranges = {}
+    for prefix, name in SEARCH_RANGES.items():
+        bounds = []
+        for bound in ('after', 'before'):
+            parameter = "{}_{}".format(prefix, bound)
+            value = args.get(parameter)
+            if value is not None:
+                try:
+                    value = parse_timestamp(value)
+                except ValueError:
+                    return _bad_request("{} must be a timestamp like "
+                                        "2024-01-31T23:59:59".format(
+                                            parameter))
+            bounds.append(value)
+        if bounds != [None, None]:
+            ranges[name] = tuple(bounds)
+    order_by = args.get('order_by', 'id')
+    if order_by not in SEARCH_ORDERS:
+        return _bad_request("order_by must be one of {}".format(
+            ", ".join(SEARCH_ORDERS)))
+    order = args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        return _bad_request("order must be asc or desc")
+    limit = _limit()
+    if limit is None:
+        return _bad_request("limit must be an integer between 1 and "
+                            "{}".format(MAX_PAGE_SIZE))
+    users = User.query(attributes, prefixes, ranges, order_by=order_by,
+                       descending=order == 'desc', limit=limit)
+    return jsonify([user.to_json() for user in users])
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
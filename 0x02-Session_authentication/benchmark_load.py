@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmark of User.load_from_file.
+
+Writes a .db_User.json file of N users to a temporary directory, then
+loads it in a fresh process with each loader and reports the startup
+time and the peak RSS of that process:
+    - json.load: the whole file parsed at once, every User built
+    - eager: the file streamed, every User built
+    - lazy: the file streamed, Users built on first access
+
+Usage:
+    ./benchmark_load.py [-n USERS ...]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+from typing import Dict, List
+
+LOADERS = ("json.load", "eager", "lazy")
+
+CHILD = """
+import json, resource, sys, time
+from models.base import DATA
+from models.user import User
+
+loader = sys.argv[1]
+start = time.perf_counter()
+if loader == "json.load":
+    with open(".db_User.json", 'r') as f:
+        objs_json = json.load(f)
+    DATA['User'] = {obj_id: User(**obj_json)
+                    for obj_id, obj_json in objs_json.items()}
+    del objs_json
+    User.rebuild_indexes()
+else:
+    User.load_from_file(lazy=loader == "lazy")
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "startup_s": elapsed,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "count": User.count(),
+}))
+"""
+
+
+def write_users(directory: str, count: int):
+    """
+    Writes count users to .db_User.json in directory.
+    """
+    with open(os.path.join(directory, ".db_User.json"), 'w') as f:
+        f.write("{")
+        for i in range(count):
+            obj_id = str(uuid.uuid4())
+            user = {
+                "id": obj_id,
+                "created_at": "2024-01-01T00:00:00",
+                "updated_at": "2024-01-01T00:00:00",
+                "email": "user{}@example.com".format(i),
+                "_password": "5e884898da28047151d0e56f8dc6292773603d0d6aa"
+                             "bbdd62a11ef721d1542d8",
+                "first_name": "First{}".format(i),
+                "last_name": "Last{}".format(i),
+            }
+            f.write("{}{}: {}".format(", " if i else "", json.dumps(obj_id),
+                                      json.dumps(user)))
+        f.write("}")
+
+
+def run(directory: str, loader: str) -> Dict[str, float]:
+    """
+    Loads the users of directory with loader in a new process.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run([sys.executable, "-c", CHILD, loader],
+                            cwd=directory, env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the loading of .db_User.json.")
+    parser.add_argument('-n', '--users', type=int, nargs='+',
+                        default=[100000, 1000000])
+    args = parser.parse_args(argv)
+
+    for count in args.users:
+        with tempfile.TemporaryDirectory() as directory:
+            write_users(directory, count)
+            for loader in LOADERS:
+                result = run(directory, loader)
+                print("{:>9,} users {:<10} {startup_s:8.2f}s "
+                      "{peak_rss_mb:10,.0f} MB".format(count, loader,
+                                                       **result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmark of the memory taken by the Users held in DATA.
+
+Builds N users the way load_from_file does and reports the memory
+allocated per user (objects, attribute values and their DATA entry),
+measured with tracemalloc, for built objects and for the JSON text kept
+by the lazy load mode.
+
+Usage:
+    ./benchmark_memory.py [-n USERS]
+"""
+
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+import uuid
+from typing import Callable, Dict, List
+
+from models.user import User
+
+
+def make_users(count: int) -> List[Dict[str, str]]:
+    """
+    Returns the JSON of count users.
+    """
+    return [{
+        "id": str(uuid.uuid4()),
+        "created_at": "2024-01-01T00:00:00",
+        "updated_at": "2024-01-01T00:00:00",
+        "email": "user{}@example.com".format(i),
+        "_password": "5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a"
+                     "11ef721d1542d8",
+        "first_name": "First{}".format(i),
+        "last_name": "Last{}".format(i),
+    } for i in range(count)]
+
+
+def measure(users: List[Dict[str, str]],
+            build: Callable[[Dict[str, str]], object]) -> float:
+    """
+    Returns the bytes allocated per user to hold build(user) by id.
+    """
+    text = json.dumps(users)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # Parsed while measured, so that the attribute values are counted
+    # as they are when read from a file.
+    users = json.loads(text)
+    objs = {}
+    for user in users:
+        objs[user["id"]] = build(user)
+    del user
+    users.clear()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size / len(objs)
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Measure the memory taken per user.")
+    parser.add_argument('-n', '--users', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    users = make_users(args.users)
+    print("User objects   {:8,.0f} bytes/user".format(
+        measure(users, lambda user: User(**user))))
+    print("lazy JSON text {:8,.0f} bytes/user".format(
+        measure(users, json.dumps)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
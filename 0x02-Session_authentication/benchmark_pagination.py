@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmark of the pagination of GET /api/v1/users.
+
+For N users, reports the mean latency of:
+    - GET /api/v1/users?all=true (every user in one response)
+    - GET /api/v1/users (the first page)
+    - GET /api/v1/users?after=<id> (a page in the middle)
+    - User.all(limit, after) (the page without the HTTP layer)
+
+Usage:
+    ./benchmark_pagination.py [-n USERS ...] [-l LIMIT] [-r REPEAT]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+os.environ.setdefault("AUTH_TYPE", "none")
+
+from api.v1.app import app  # noqa: E402
+from models import base  # noqa: E402
+from models.user import User  # noqa: E402
+
+
+def make_users(count: int):
+    """
+    Stores count users, then loads them to index them.
+    """
+    base.DATA["User"] = {}
+    for i in range(count):
+        user = User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i),
+                    last_name="Last{}".format(i))
+        base.DATA["User"][user.id] = user
+    User.save_to_file()
+    User.load_from_file()
+
+
+def timed(repeat: int, function, *args, **kwargs) -> float:
+    """
+    Mean time in ms of a call of function.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(*args, **kwargs)
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pagination of GET /api/v1/users.")
+    parser.add_argument('-n', '--users', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('-l', '--limit', type=int, default=100)
+    parser.add_argument('-r', '--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    client = app.test_client()
+    cwd = os.getcwd()
+    for count in args.users:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                make_users(count)
+                middle = sorted(base.DATA["User"])[count // 2]
+                every = timed(max(1, args.repeat // 10), client.get,
+                              "/api/v1/users?all=true")
+                first = timed(args.repeat, client.get,
+                              "/api/v1/users?limit={}".format(args.limit))
+                page = timed(args.repeat, client.get,
+                             "/api/v1/users?limit={}&after={}".format(
+                                 args.limit, middle))
+                model = timed(args.repeat, User.all, limit=args.limit,
+                              after=middle)
+            finally:
+                os.chdir(cwd)
+        print("{:>9,} users  all {:9.1f}ms  first page {:6.2f}ms  "
+              "middle page {:6.2f}ms  User.all(limit={}) {:6.3f}ms".format(
+                  count, every, first, page, args.limit, model))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
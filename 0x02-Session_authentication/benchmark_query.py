@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmark of the queries of Base.query, served by sorted indexes.
+
+For N users created over the last 30 days, reports the mean latency of
+these queries, with User.query and with a scan of User.all() (filtered,
+then sorted, as without sorted indexes):
+    - email prefix: the users whose email starts with "user12"
+    - last_name prefix: the 10 first users by last name starting with
+      "smi"
+    - last hour: the 100 users created last, in the last hour
+and of the last one through GET /api/v1/users/search.
+
+Usage:
+    ./benchmark_query.py [-n USERS ...] [-r REPEAT]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List
+
+os.environ.setdefault("AUTH_TYPE", "none")
+
+from api.v1.app import app  # noqa: E402
+from models import base  # noqa: E402
+from models.base import format_timestamp  # noqa: E402
+from models.user import User  # noqa: E402
+
+LAST_NAMES = ["Smith", "Smithers", "Jones", "Johnson", "Brown", "Garcia",
+              "Miller", "Davis", "Martinez", "Wilson"]
+
+
+def make_users(count: int):
+    """
+    Stores count users created over the last 30 days, then loads them to
+    index them.
+    """
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    base.DATA["User"] = {}
+    for i in range(count):
+        created_at = now - timedelta(seconds=rng.randrange(30 * 86400))
+        user = User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i),
+                    last_name="{}{}".format(rng.choice(LAST_NAMES),
+                                            rng.randrange(1000)),
+                    created_at=created_at, updated_at=created_at)
+        base.DATA["User"][user.id] = user
+    User.save_to_file()
+    User.load_from_file()
+
+
+def timed(repeat: int, function: Callable, *args, **kwargs) -> float:
+    """
+    Mean time in ms of a call of function.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(*args, **kwargs)
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+def scan(match: Callable, key: Callable, reverse: bool = False,
+         limit: int = None) -> List[User]:
+    """
+    Query by scanning all the users.
+    """
+    users = sorted(filter(match, User.all()), key=key, reverse=reverse)
+    return users if limit is None else users[:limit]
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the queries served by sorted indexes.")
+    parser.add_argument('-n', '--users', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('-r', '--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    client = app.test_client()
+    cwd = os.getcwd()
+    for count in args.users:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                make_users(count)
+                hour_ago = datetime.utcnow() - timedelta(hours=1)
+                queries = {
+                    "email prefix": (
+                        lambda: User.query(prefixes={'email': "user12"}),
+                        lambda: scan(
+                            lambda u: u.email.startswith("user12"),
+                            lambda u: u.id)),
+                    "last_name prefix": (
+                        lambda: User.query(prefixes={'last_name': "smi"},
+                                           order_by='last_name', limit=10),
+                        lambda: scan(
+                            lambda u: u.last_name.lower().startswith("smi"),
+                            lambda u: (u.last_name.lower(), u.id),
+                            limit=10)),
+                    "last hour": (
+                        lambda: User.query(ranges={'created_at':
+                                                   (hour_ago, None)},
+                                           order_by='created_at',
+                                           descending=True, limit=100),
+                        lambda: scan(lambda u: u.created_at >= hour_ago,
+                                     lambda u: (u.created_at, u.id),
+                                     reverse=True, limit=100)),
+                }
+                results = []
+                for name, (query, scanned) in queries.items():
+                    assert [u.id for u in query()] == \
+                        [u.id for u in scanned()], name
+                    results.append((name, timed(args.repeat, query),
+                                    timed(max(1, args.repeat // 10),
+                                          scanned)))
+                http = timed(args.repeat, client.get,
+                             "/api/v1/users/search?created_after={}&"
+                             "order_by=created_at&order=desc&limit=100"
+                             .format(format_timestamp(hour_ago)))
+            finally:
+                os.chdir(cwd)
+        for name, query, scanned in results:
+            print("{:>9,} users  {:<16} query {:7.3f}ms  scan {:8.1f}ms"
+                  .format(count, name, query, scanned))
+        print("{:>9,} users  {:<16} GET /api/v1/users/search {:6.2f}ms"
+              .format(count, "last hour", http))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
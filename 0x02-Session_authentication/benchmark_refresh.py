@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmark of the cross-process refresh of the model store.
+
+For N users and every PERSISTENCE, loads the store, then reports:
+    - the cost of refresh() when no other process wrote (the check)
+    - the time refresh() takes to apply the saves of K users made by
+      another process
+    - the time a full load_from_file takes, for comparison
+
+Usage:
+    ./benchmark_refresh.py [-n USERS ...] [-k CHANGED]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+from models import base
+from models.user import User
+
+CHILD = """
+import sys
+from models.user import User
+
+User.load_from_file()
+for i in range(int(sys.argv[1])):
+    user = User.get("user-{}".format(i))
+    user.first_name = "Changed"
+    user.save()
+"""
+
+
+def change(directory: str, persistence: str, count: int):
+    """
+    Saves count users in another process.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(__file__))
+    env["PERSISTENCE"] = persistence
+    subprocess.run([sys.executable, "-c", CHILD, str(count)],
+                   cwd=directory, env=env, check=True)
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the cross-process refresh of the models.")
+    parser.add_argument('-n', '--users', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('-k', '--changed', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    cwd = os.getcwd()
+    for count in args.users:
+        for persistence in ("journal", "snapshot"):
+            User.persistence = persistence
+            with tempfile.TemporaryDirectory() as directory:
+                os.chdir(directory)
+                try:
+                    base.DATA["User"] = {}
+                    base.INDEXES.pop("User", None)
+                    for i in range(count):
+                        user = User(id="user-{}".format(i),
+                                    email="user{}@example.com".format(i))
+                        base.DATA["User"][user.id] = user
+                    User.save_to_file()
+                    User.load_from_file()
+
+                    checks = 10000
+                    start = time.perf_counter()
+                    for _ in range(checks):
+                        User.refresh()
+                    check = (time.perf_counter() - start) / checks
+
+                    change(directory, persistence, args.changed)
+                    start = time.perf_counter()
+                    User.refresh()
+                    refresh = time.perf_counter() - start
+                    assert User.get("user-0").first_name == "Changed"
+
+                    start = time.perf_counter()
+                    User.load_from_file()
+                    load = time.perf_counter() - start
+                finally:
+                    os.chdir(cwd)
+            print("{:>9,} users {:<8} check {:6.1f}us  refresh after {} "
+                  "saves {:8.1f}ms  full load {:8.1f}ms".format(
+                      count, persistence, check * 1e6, args.changed,
+                      refresh * 1e3, load * 1e3))
+    del User.persistence
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmark of the snapshot formats of the model store.
+
+For N users, saves the store in every SNAPSHOT_FORMAT and reports the
+save time and the file size, then loads each file in a fresh process,
+eagerly and lazily, and reports the startup time and peak RSS.
+
+Usage:
+    ./benchmark_snapshot.py [-n USERS ...]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from models import base
+from models.user import User
+
+CHILD = """
+import json, resource, sys, time
+from models.user import User
+
+start = time.perf_counter()
+User.load_from_file(lazy=sys.argv[1] == "lazy")
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "startup_s": elapsed,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def make_users(count: int):
+    """
+    Fills the store with count users.
+    """
+    base.DATA["User"] = {}
+    base.INDEXES.pop("User", None)
+    for i in range(count):
+        user = User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i),
+                    last_name="Last{}".format(i))
+        user.password = "password{}".format(i)
+        base.DATA["User"][user.id] = user
+
+
+def load(directory: str, snapshot_format: str,
+         mode: str) -> Dict[str, float]:
+    """
+    Loads the users of directory in a new process.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(__file__))
+    env["SNAPSHOT_FORMAT"] = snapshot_format
+    output = subprocess.run([sys.executable, "-c", CHILD, mode],
+                            cwd=directory, env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the snapshot formats of the model store.")
+    parser.add_argument('-n', '--users', type=int, nargs='+',
+                        default=[100000, 1000000])
+    args = parser.parse_args(argv)
+
+    cwd = os.getcwd()
+    for count in args.users:
+        make_users(count)
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                for snapshot_format in base.SNAPSHOT_EXTENSIONS:
+                    User.snapshot_format = snapshot_format
+                    start = time.perf_counter()
+                    User.save_to_file()
+                    saved = time.perf_counter() - start
+                    size = os.path.getsize(User._snapshot_path())
+                    print("{:>9,} users {:<6} save {:6.2f}s  size {:7.1f} MB"
+                          .format(count, snapshot_format, saved,
+                                  size / (1 << 20)))
+                    for mode in ("eager", "lazy"):
+                        result = load(directory, snapshot_format, mode)
+                        print("{:>9,} users {:<6} load {:<5} {startup_s:6.2f}s"
+                              "  peak {peak_rss_mb:7,.0f} MB".format(
+                                  count, snapshot_format, mode, **result))
+            finally:
+                del User.snapshot_format
+                os.chdir(cwd)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmark of the storage engines of the models.
+
+For N users and every STORAGE (the "file" storage with the journal
+persistence, since snapshot rewrites make its saves quadratic), saves
+the users one by one in a fresh process, then starts another process
+that loads the store and runs queries, and reports:
+    - the save rate
+    - the startup time (load_from_file) and peak RSS after the queries
+    - the mean latency of get by id, search by email, count and all
+
+Usage:
+    ./benchmark_storage.py [-n USERS ...] [-q QUERIES]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+ENGINES = {
+    "file": {"STORAGE": "file", "PERSISTENCE": "journal"},
+    "sqlite": {"STORAGE": "sqlite"},
+}
+
+POPULATE = """
+import json, sys, time
+from models.user import User
+
+User.load_from_file()
+count = int(sys.argv[1])
+start = time.perf_counter()
+for i in range(count):
+    user = User(id="user-{}".format(i), email="user{}@example.com".format(i),
+                first_name="First{}".format(i), last_name="Last{}".format(i))
+    user.password = "password{}".format(i)
+    user.save()
+print(json.dumps({"saves_per_s": count / (time.perf_counter() - start)}))
+"""
+
+QUERY = """
+import json, random, resource, sys, time
+from models.user import User
+
+count, queries = int(sys.argv[1]), int(sys.argv[2])
+clock = time.perf_counter
+start = clock()
+User.load_from_file()
+result = {"startup_s": clock() - start}
+random.seed(0)
+picks = [random.randrange(count) for _ in range(queries)]
+
+start = clock()
+for i in picks:
+    assert User.get("user-{}".format(i)) is not None
+result["get_us"] = (clock() - start) / queries * 1e6
+start = clock()
+for i in picks:
+    assert len(User.search({"email": "user{}@example.com".format(i)})) == 1
+result["search_us"] = (clock() - start) / queries * 1e6
+start = clock()
+assert User.count() == count
+result["count_ms"] = (clock() - start) * 1e3
+start = clock()
+assert len(User.all()) == count
+result["all_s"] = clock() - start
+result["peak_rss_mb"] = \\
+    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(result))
+"""
+
+
+def run(directory: str, engine: str, script: str,
+        *args: int) -> Dict[str, float]:
+    """
+    Runs script with the engine in a new process in directory.
+    """
+    env = dict(os.environ)
+    env.update(ENGINES[engine])
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run([sys.executable, "-c", script] +
+                            [str(arg) for arg in args],
+                            cwd=directory, env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the storage engines of the models.")
+    parser.add_argument('-n', '--users', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('-q', '--queries', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    for count in args.users:
+        for engine in ENGINES:
+            with tempfile.TemporaryDirectory() as directory:
+                result = run(directory, engine, POPULATE, count)
+                result.update(run(directory, engine, QUERY, count,
+                                  args.queries))
+            print("{:>9,} users {:<6} {saves_per_s:>8,.0f} saves/s  "
+                  "startup {startup_s:6.2f}s  get {get_us:7.1f}us  "
+                  "search {search_us:7.1f}us  count {count_ms:7.2f}ms  "
+                  "all {all_s:6.2f}s  peak {peak_rss_mb:6,.0f} MB".format(
+                      count, engine, **result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
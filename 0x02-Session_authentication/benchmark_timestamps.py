@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmark of the timestamp conversions of Base.
+
+Builds N users from their JSON, as load_from_file does, then converts
+them back with to_json, as GET /api/v1/users does, once with
+strptime/strftime and once with parse_timestamp/format_timestamp.
+Every user has distinct timestamps, so the parse cache does not help.
+
+Usage:
+    ./benchmark_timestamps.py [-n USERS]
+"""
+
+import argparse
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from models import base
+from models.user import User
+
+CONVERSIONS = {
+    "strptime/strftime": (
+        lambda value: datetime.strptime(value, base.TIMESTAMP_FORMAT),
+        lambda value: value.strftime(base.TIMESTAMP_FORMAT)),
+    "fast path": (base.parse_timestamp, base.format_timestamp),
+}
+
+
+def make_users(count: int) -> List[Dict[str, str]]:
+    """
+    Returns the JSON of count users with distinct timestamps.
+    """
+    start = datetime(2020, 1, 1)
+    users = []
+    for i in range(count):
+        timestamp = start + timedelta(seconds=i)
+        users.append({
+            "id": str(uuid.uuid4()),
+            "created_at": timestamp.strftime(base.TIMESTAMP_FORMAT),
+            "updated_at": (timestamp + timedelta(days=1)).strftime(
+                base.TIMESTAMP_FORMAT),
+            "email": "user{}@example.com".format(i),
+        })
+    return users
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the timestamp conversions of Base.")
+    parser.add_argument('-n', '--users', type=int, default=200000)
+    args = parser.parse_args(argv)
+
+    users = make_users(args.users)
+    results = {}
+    for name, (parse, format_) in CONVERSIONS.items():
+        base.parse_timestamp, base.format_timestamp = parse, format_
+        start = time.perf_counter()
+        objs = [User(**user) for user in users]
+        loaded = time.perf_counter()
+        output = [obj.to_json() for obj in objs]
+        serialised = time.perf_counter()
+        results[name] = output
+        print("{:<18} load {:7.2f}s  to_json {:7.2f}s".format(
+            name, loaded - start, serialised - loaded))
+    base.parse_timestamp, base.format_timestamp = CONVERSIONS["fast path"]
+    if len({repr(output) for output in results.values()}) != 1:
+        print("the conversions differ")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
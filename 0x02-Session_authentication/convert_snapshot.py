@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+
+"""
+Converts the snapshot of a model class between the JSON and the binary
+formats.
+
+Reads .db_<Class>.json (or .db_<Class>.bin) and its journal from the
+current directory, and writes .db_<Class>.bin (or .db_<Class>.json).
+The source file is left in place, but the journal is emptied into the
+new snapshot. Objects are not built on the way: their attributes are
+decoded from one format and encoded in the other.
+
+Usage:
+    ./convert_snapshot.py {json,binary} [-c CLASS ...]
+"""
+
+import argparse
+import sys
+from typing import List
+
+from models.base import SNAPSHOT_EXTENSIONS
+from models.user import User
+
+MODELS = {"User": User}
+
+
+def convert(cls: type, to_format: str) -> int:
+    """
+    Rewrites the snapshot of cls in to_format.
+
+    Returns:
+        int: The number of objects converted.
+    """
+    from_format = "json" if to_format == "binary" else "binary"
+    own_format = cls.__dict__.get("snapshot_format")
+    try:
+        cls.snapshot_format = from_format
+        cls.load_from_file(lazy=True)
+        cls.snapshot_format = to_format
+        cls.save_to_file()
+    finally:
+        if own_format is None:
+            del cls.snapshot_format
+        else:
+            cls.snapshot_format = own_format
+    return cls.count()
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert model snapshots between JSON and binary.")
+    parser.add_argument('format', choices=sorted(SNAPSHOT_EXTENSIONS),
+                        help="format to convert to")
+    parser.add_argument('-c', '--class', dest='classes', action='append',
+                        choices=sorted(MODELS),
+                        help="class to convert (default: all)")
+    args = parser.parse_args(argv)
+
+    for name in args.classes or sorted(MODELS):
+        count = convert(MODELS[name], args.format)
+        print("{}: {} objects written to .db_{}.{}".format(
+            name, count, name, SNAPSHOT_EXTENSIONS[args.format]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,305 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from contextlib import contextmanager
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from functools import lru_cache, partial
+from typing import (TypeVar, List, Iterable, Iterator, Callable, Dict, Any,
+                    Optional)
+from os import getenv, path
+import atexit
+import fcntl
 import json
+import logging
+import os
+import re
+import threading
+import time
 import uuid
 
+from models.binary_snapshot import BinarySnapshot, write_snapshot
+from models.sorted_index import SortedIndex, prefix_end, sort_key
+from models.sqlite_storage import SQLiteStorage
+
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# Timestamps that datetime.fromisoformat parses exactly like strptime
+# with TIMESTAMP_FORMAT
+_ISO_TIMESTAMP = re.compile(
+    r'\d{4}-\d\d-\d\dT(?:[01]\d|2[0-3]):[0-5]\d:[0-5]\d', re.ASCII)
 DATA = {}
+INDEXES = {}
+# Sorted indexes of each class: "id" holds the sort_key of every id, for
+# pagination (Base.all with limit or after), and every sorted attribute
+# the sort_key of its value followed by the sort_key of the id, for
+# every object, for the prefixes, ranges and orders of Base.query
+SORTED_INDEXES = {}
+JOURNALS = {}
+
+# "snapshot": every save/remove rewrites .db_<Class>.json
+# "journal": every save/remove appends one line to .db_<Class>.journal,
+#            which is compacted into the snapshot once it holds more
+#            records than max(JOURNAL_COMPACT_MIN, number of objects)
+PERSISTENCE = getenv("PERSISTENCE", "snapshot")
+JOURNAL_COMPACT_MIN = 1000
+
+# When save/remove reach the disk:
+# "sync": before they return
+# "interval": a background thread writes the pending changes of each
+#             class every FLUSH_INTERVAL seconds, or as soon as
+#             FLUSH_BATCH objects are pending
+# "shutdown": on flush_all(), which also runs at process exit
+# Pending changes are coalesced per object, and written with one
+# snapshot rewrite or one journal append per class.
+DURABILITY = getenv("DURABILITY", "sync")
+FLUSH_INTERVAL = float(getenv("FLUSH_INTERVAL", "1.0"))
+FLUSH_BATCH = int(getenv("FLUSH_BATCH", "100"))
+PENDING = {}
+_WRITE_LOCK = threading.RLock()
+_flusher = None
+
+# Threads: the writers of DATA and INDEXES (save, remove, loads, setting
+# an indexed attribute of a stored object, building a lazy object) hold
+# _WRITE_LOCK; the readers (get, search, count, all) take no lock. They
+# read through operations that are atomic under the GIL (dict.get,
+# list() of a dict), and writers add an object to its new index buckets,
+# then publish it in DATA, then remove it from its old buckets (see
+# Base._reindex), so that readers see either the old or the new state.
+# Loads and index rebuilds close the gate of the class, which readers
+# wait for.
+_GATES = {}
+
+# "eager": load_from_file builds every object
+# "lazy": load_from_file keeps the JSON text (or binary record) of each
+#         object and builds it on first access (get, search...)
+LOAD_MODE = getenv("LOAD_MODE", "eager")
+_MISSING = object()
+
+# Format of the snapshot files:
+# "json": .db_<Class>.json, a JSON object of the objects by id
+# "binary": .db_<Class>.bin, see models.binary_snapshot
+# convert_snapshot.py converts the files of a class between formats.
+SNAPSHOT_FORMAT = getenv("SNAPSHOT_FORMAT", "json")
+SNAPSHOT_EXTENSIONS = {"json": "json", "binary": "bin"}
+TIMESTAMP_ATTRIBUTES = ('created_at', 'updated_at')
+
+# Where the objects live:
+# "file": in DATA, persisted to the files above
+# "sqlite": in a SQLite database (SQLITE_PATH, default .db.sqlite3),
+#           see models.sqlite_storage; PERSISTENCE, DURABILITY,
+#           LOAD_MODE and SNAPSHOT_FORMAT do not apply
+STORAGE = getenv("STORAGE", "file")
+STORAGE_ENGINES = {"sqlite": SQLiteStorage}
+_storages = {}
+
+# Processes sharing the files of a class (e.g. WSGI workers): refresh()
+# applies the changes the others made since the last load or refresh,
+# found with the identity (inode, size, mtime) of the snapshot and the
+# offset read up to in the journal, checked at most every
+# REFRESH_INTERVAL seconds. Writes refresh first, holding an exclusive
+# flock() of .db_<Class>.lock; loads and refreshes hold it shared.
+REFRESH_INTERVAL = float(getenv("REFRESH_INTERVAL", "0"))
+FILE_STATES = {}
+_file_locks = {}
+
+
+def _hashable(value: Any) -> bool:
+    """ Whether a value can be used as an index key
+    """
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+@lru_cache(maxsize=1024)
+def parse_timestamp(value: str) -> datetime:
+    """ datetime.strptime(value, TIMESTAMP_FORMAT), with a fast path for
+    the timestamps written by format_timestamp
+    Cached: objects saved together share their timestamps.
+    """
+    if type(value) is str and _ISO_TIMESTAMP.fullmatch(value):
+        return datetime.fromisoformat(value)
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def _wait_gate(s_class: str):
+    """ Wait for the load or index rebuild of a class in progress
+    """
+    gate = _GATES.get(s_class)
+    if gate is not None and not gate.is_set():
+        gate.wait()
+
+
+def _file_id(file_path: str) -> Optional[tuple]:
+    """ Identity of a file: (inode, size, mtime), None if missing
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _hold_snapshot(state: dict, file_path: str):
+    """ Record the identity of a snapshot file in the file state of its
+    class, keeping it open: its inode cannot be reused by a later
+    snapshot while they are compared
+    """
+    try:
+        handle = os.open(file_path, os.O_RDONLY)
+    except FileNotFoundError:
+        handle = None
+    if state.get('handle') is not None:
+        os.close(state['handle'])
+    state['handle'] = handle
+    if handle is None:
+        state['snapshot'] = None
+    else:
+        stat = os.fstat(handle)
+        state['snapshot'] = stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def format_timestamp(value: datetime) -> str:
+    """ value.strftime(TIMESTAMP_FORMAT), with a fast path for naive
+    datetimes of years 1000 and later
+    """
+    if value.tzinfo is None and value.year >= 1000:
+        return value.isoformat(timespec='seconds')
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def iter_json_entries(f, chunk_size: int = 1 << 16,
+                      raw: bool = False) -> Iterable[tuple]:
+    """ Yield the (key, value) pairs of the JSON object stored in file f,
+    reading it chunk_size characters at a time instead of all at once
+    With raw, yield (key, value, JSON text of the value) triples.
+    """
+    decode = json.JSONDecoder().raw_decode
+    whitespace = " \t\r\n"
+    buffer = ""
+    pos = 0
+    eof = False
+    opened = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in whitespace + ",":
+            pos += 1
+        incomplete = pos == len(buffer)
+        if not incomplete and not opened:
+            if buffer[pos] != '{':
+                raise ValueError("Expected a JSON object")
+            opened = True
+            pos += 1
+            continue
+        if not incomplete and buffer[pos] == '}':
+            return
+        if not incomplete:
+            try:
+                key, end = decode(buffer, pos)
+                while buffer[end] in whitespace:
+                    end += 1
+                if buffer[end] != ':':
+                    raise ValueError("Expected ':' after a JSON key")
+                end += 1
+                while buffer[end] in whitespace:
+                    end += 1
+                start = end
+                value, end = decode(buffer, end)
+                # A value ending the buffer, or a number cut short by
+                # it ("1." decodes as 1), may continue in the file.
+                incomplete = not eof and (
+                    end == len(buffer) or
+                    buffer[end] not in whitespace + ",}")
+            except (ValueError, IndexError):
+                if eof:
+                    raise
+                incomplete = True
+        if incomplete:
+            if eof:
+                raise ValueError("Unexpected end of JSON file")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        if raw:
+            yield key, value, buffer[start:end]
+        else:
+            yield key, value
+        pos = end
+
+
+class LazyStore(dict):
+    """ Objects of a class by id, holding the raw form of the objects
+    that were not accessed yet (JSON text, or offset in a binary
+    snapshot) and building them on first access
+    decode turns a raw form into the attributes of the object.
+    """
+
+    def __init__(self, cls: type, decode: Callable[[Any], dict]):
+        super().__init__()
+        self.cls = cls
+        self.decode = decode
+
+    def _build(self, key: str, value: Any) -> Any:
+        """ Replace a raw form by the object it describes
+        Builds are writes: threads building the same object concurrently
+        get the same one, and a save or remove is never undone by one.
+        """
+        if isinstance(value, Base):
+            return value
+        with _WRITE_LOCK:
+            current = dict.get(self, key)
+            if isinstance(current, Base):
+                return current
+            obj = self.cls(**self.decode(value))
+            if current is value:
+                dict.__setitem__(self, key, obj)
+        return obj
+
+    def __getitem__(self, key: str) -> Any:
+        return self._build(key, dict.__getitem__(self, key))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = dict.get(self, key, _MISSING)
+        if value is _MISSING:
+            return default
+        return self._build(key, value)
+
+    def values(self) -> List[Any]:
+        return [self._build(key, value)
+                for key, value in list(dict.items(self))]
+
+    def items(self) -> List[tuple]:
+        return [(key, self._build(key, value))
+                for key, value in list(dict.items(self))]
 
 
 class Base():
     """ Base class
     """
 
+    # Attributes are stored in slots rather than in a __dict__ per
+    # instance. Subclasses declaring __slots__ for their own attributes
+    # stay compact; the others get a __dict__ as usual.
+    __slots__ = ('id', 'created_at', 'updated_at')
+
+    # Secondary indexes: attribute name -> normaliser of the index key
+    # (None to index the value as is). Indexes are kept up to date by
+    # save, remove, load_from_file and attribute assignments, and used
+    # by search when a query covers an indexed attribute.
+    indexed_attributes: Dict[str, Callable[[Any], Any]] = {}
+    # Sorted indexes: attribute name -> normaliser of the values (None
+    # to sort them as they are), kept up to date like the secondary
+    # indexes, and used by query for prefixes, ranges and orders.
+    sorted_attributes: Dict[str, Callable[[Any], Any]] = {
+        'created_at': None, 'updated_at': None}
+    persistence = PERSISTENCE
+    durability = DURABILITY
+    snapshot_format = SNAPSHOT_FORMAT
+    storage = STORAGE
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
@@ -23,17 +307,305 @@ class Base():
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
-        if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
+        # Timestamps are strings in JSON, datetimes in binary snapshots.
+        # A new object is not stored: they are set without reindexing.
+        created_at = kwargs.get('created_at')
+        if type(created_at) is not datetime:
+            created_at = datetime.utcnow() if created_at is None \
+                else parse_timestamp(created_at)
+        object.__setattr__(self, 'created_at', created_at)
+        updated_at = kwargs.get('updated_at')
+        if type(updated_at) is not datetime:
+            updated_at = datetime.utcnow() if updated_at is None \
+                else parse_timestamp(updated_at)
+        object.__setattr__(self, 'updated_at', updated_at)
+
+    def __setattr__(self, name: str, value: Any):
+        """ Set an attribute, updating its index for stored objects
+        """
+        if name not in self.indexed_attributes and \
+                name not in self.sorted_attributes:
+            object.__setattr__(self, name, value)
+            return
+        with _WRITE_LOCK:
+            if not self._is_stored():
+                object.__setattr__(self, name, value)
+                return
+            self._reindex(self.id, {name: getattr(self, name, None)},
+                          {name: value},
+                          partial(object.__setattr__, self, name, value))
+
+    def _is_stored(self) -> bool:
+        """ Whether this instance is the one stored in DATA
+        """
+        objs = DATA.get(self.__class__.__name__)
+        obj_id = getattr(self, 'id', None)
+        # dict.get: looking an object up must not build it (LazyStore)
+        return objs is not None and dict.get(objs, obj_id) is self
+
+    @classmethod
+    def _index_key(cls, name: str, value: Any) -> Any:
+        """ Index key of an attribute value
+        """
+        normalise = cls.indexed_attributes[name]
+        if normalise is not None and isinstance(value, str):
+            return normalise(value)
+        return value
+
+    @classmethod
+    def _sort_value(cls, name: str, value: Any) -> Any:
+        """ Value of an attribute as its sorted index orders it: with
+        timestamps read from JSON parsed, and normalised
+        """
+        if type(value) is not str:
+            return value
+        if name in TIMESTAMP_ATTRIBUTES:
+            try:
+                return parse_timestamp(value)
+            except ValueError:
+                pass
+        normalise = cls.sorted_attributes.get(name)
+        if normalise is not None:
+            return normalise(value)
+        return value
+
+    @classmethod
+    def _sort_item(cls, name: str, value: Any, id_key: tuple) -> tuple:
+        """ Item of an object in the sorted index of an attribute, from
+        the sort_key of its id: the sort_key of the value, then id_key
+        """
+        return sort_key(cls._sort_value(name, value)) + id_key
+
+    @classmethod
+    def _keyed_attributes(cls) -> tuple:
+        """ Names of the indexed and sorted attributes of the class
+        """
+        names = cls.__dict__.get('_keyed_names')
+        if names is None:
+            names = tuple(dict.fromkeys(list(cls.indexed_attributes) +
+                                        list(cls.sorted_attributes)))
+            cls._keyed_names = names
+        return names
+
+    @classmethod
+    def _indexes(cls) -> dict:
+        """ Indexes of the class: attribute -> key -> {id: None}
+        """
+        s_class = cls.__name__
+        indexes = INDEXES.get(s_class)
+        if indexes is None:
+            indexes = INDEXES[s_class] = {name: {} for name
+                                          in cls.indexed_attributes}
+        return indexes
+
+    @classmethod
+    def _sorted_indexes(cls) -> dict:
+        """ Sorted indexes of the class: "id" or attribute -> SortedIndex
+        """
+        s_class = cls.__name__
+        indexes = SORTED_INDEXES.get(s_class)
+        if indexes is None:
+            indexes = {name: SortedIndex() for name
+                       in cls.sorted_attributes}
+            indexes['id'] = SortedIndex()
+            SORTED_INDEXES[s_class] = indexes
+        return indexes
+
+    @classmethod
+    @contextmanager
+    def _resetting_indexes(cls) -> Iterator[None]:
+        """ Empty the indexes of the class, to fill them again; the
+        items of the sorted indexes are sorted once, on exit
+        """
+        INDEXES.pop(cls.__name__, None)
+        SORTED_INDEXES.pop(cls.__name__, None)
+        cls._indexes()
+        sorted_indexes = cls._sorted_indexes().values()
+        for index in sorted_indexes:
+            index.defer()
+        try:
+            yield
+        finally:
+            for index in sorted_indexes:
+                index.build()
+
+    @classmethod
+    def _reindex(cls, obj_id: str, old: Optional[dict], new: Optional[dict],
+                 publish: Callable[[], Any] = None):
+        """ Move an object from the indexed and sorted attribute values
+        old to the values new (attribute -> value, None without entry),
+        calling publish (if any) in between
+        The new keys are added before publish and the old ones removed
+        after it, so that a lock-free reader that finds the id in a bucket
+        (or sorted index) and then looks the object up sees it under the
+        right key.
+        """
+        indexes = cls._indexes()
+        sorted_indexes = cls._sorted_indexes()
+        id_key = sort_key(obj_id)
+        if old is not None and new is not None:
+            # Unchanged values keep their keys
+            unchanged = [name for name, value in new.items()
+                         if name in old and old[name] is value]
+            if unchanged:
+                old, new = dict(old), dict(new)
+                for name in unchanged:
+                    del old[name], new[name]
+        elif new is not None:
+            sorted_indexes['id'].add(id_key)
+        buckets = {}
+        items = {}
+        for name, value in (new or {}).items():
+            if name in cls.sorted_attributes:
+                items[name] = cls._sort_item(name, value, id_key)
+                sorted_indexes[name].add(items[name])
+            if name not in cls.indexed_attributes:
+                continue
+            key = cls._index_key(name, value)
+            if _hashable(key):
+                buckets[name] = indexes[name].setdefault(key, {})
+                buckets[name][obj_id] = None
+        if publish is not None:
+            publish()
+        for name, value in (old or {}).items():
+            if name in cls.sorted_attributes:
+                item = cls._sort_item(name, value, id_key)
+                if item != items.get(name):
+                    sorted_indexes[name].discard(item)
+            if name not in cls.indexed_attributes:
+                continue
+            key = cls._index_key(name, value)
+            if not _hashable(key):
+                continue
+            bucket = indexes[name].get(key)
+            if bucket is not None and bucket is not buckets.get(name):
+                bucket.pop(obj_id, None)
+                if not bucket:
+                    del indexes[name][key]
+        if new is None and old is not None:
+            sorted_indexes['id'].discard(id_key)
+
+    def _keys(self) -> dict:
+        """ Indexed and sorted attribute values of this object:
+        attribute -> value
+        """
+        return {name: getattr(self, name, None)
+                for name in self._keyed_attributes()}
+
+    @classmethod
+    def _json_keys(cls, obj_json: dict) -> dict:
+        """ Indexed and sorted attribute values of an object not built
+        yet, from its JSON
+        """
+        return {name: obj_json.get(name)
+                for name in cls._keyed_attributes()}
+
+    @classmethod
+    def _entry_keys(cls, obj_id: str) -> Optional[dict]:
+        """ Indexed and sorted attribute values of the entry stored in
+        DATA under obj_id, built or not (None without entry)
+        """
+        objs = DATA.get(cls.__name__, {})
+        obj = dict.get(objs, obj_id)
+        if obj is None:
+            return None
+        if isinstance(obj, Base):
+            return obj._keys()
+        return cls._json_keys(objs.decode(obj))
+
+    def _index(self):
+        """ Add this object to the indexes
+        """
+        self._reindex(self.id, None, self._keys())
+
+    @classmethod
+    def _index_json(cls, obj_id: str, obj_json: dict, add: bool = True):
+        """ Add (or remove) an object not built yet to (from) the
+        indexes, from its JSON
+        """
+        keys = cls._json_keys(obj_json)
+        if add:
+            cls._reindex(obj_id, None, keys)
+        else:
+            cls._reindex(obj_id, keys, None)
+
+    @classmethod
+    def _index_entry(cls, obj_id: str, add: bool = True):
+        """ Add (or remove) the entry stored in DATA under obj_id, built
+        or not, to (from) the indexes
+        """
+        keys = cls._entry_keys(obj_id)
+        if keys is None:
+            return
+        if add:
+            cls._reindex(obj_id, None, keys)
         else:
-            self.created_at = datetime.utcnow()
-        if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            cls._reindex(obj_id, keys, None)
+
+    @classmethod
+    def _put(cls, obj_id: str, obj_json: dict, text: str = None):
+        """ Store the object of obj_json (or its JSON text, in a lazy
+        store) under obj_id, unless the entry stored there is the same
+        """
+        objs = DATA[cls.__name__]
+        current = dict.get(objs, obj_id)
+        if current is not None:
+            if isinstance(current, Base):
+                if current.to_json(True) == obj_json:
+                    return
+            elif text is not None and current == text:
+                return
+            elif cls._json_attributes(objs.decode(current)) == obj_json:
+                return
+        if text is not None:
+            entry, keys = text, cls._json_keys(obj_json)
         else:
-            self.updated_at = datetime.utcnow()
+            entry = cls(**obj_json)
+            keys = entry._keys()
+        cls._reindex(obj_id, cls._entry_keys(obj_id), keys,
+                     partial(dict.__setitem__, objs, obj_id, entry))
+
+    @classmethod
+    def _drop(cls, obj_id: str) -> bool:
+        """ Remove the entry stored under obj_id, if any; return whether
+        there was one
+        """
+        objs = DATA[cls.__name__]
+        if dict.get(objs, obj_id) is None:
+            return False
+        cls._reindex(obj_id, cls._entry_keys(obj_id), None,
+                     partial(dict.__delitem__, objs, obj_id))
+        return True
+
+    @classmethod
+    @contextmanager
+    def _exclusive(cls) -> Iterator[None]:
+        """ Hold the write lock, with the gate of the class closed:
+        readers wait until the store and indexes are whole again
+        """
+        with _WRITE_LOCK:
+            gate = _GATES.get(cls.__name__)
+            if gate is None:
+                gate = _GATES[cls.__name__] = threading.Event()
+                gate.set()
+            if not gate.is_set():
+                # Nested in another rebuild of the class
+                yield
+                return
+            gate.clear()
+            try:
+                yield
+            finally:
+                gate.set()
+
+    @classmethod
+    def rebuild_indexes(cls):
+        """ Rebuild the indexes of the class from DATA
+        """
+        with cls._exclusive(), cls._resetting_indexes():
+            for obj_id in list(DATA.get(cls.__name__, {})):
+                cls._index_entry(obj_id)
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -44,81 +616,543 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @classmethod
+    def _attribute_names(cls) -> tuple:
+        """ Names of the slots of the class, base classes first
+        """
+        names = cls.__dict__.get('_slot_names')
+        if names is None:
+            names = tuple(name for klass in reversed(cls.__mro__)
+                          for name in klass.__dict__.get('__slots__', ())
+                          if name not in ('__dict__', '__weakref__'))
+            cls._slot_names = names
+        return names
+
+    def _attributes(self) -> Iterable[tuple]:
+        """ (name, value) pairs of the attributes set on the object
+        """
+        for name in self._attribute_names():
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                yield name, value
+        if hasattr(self, '__dict__'):
+            yield from self.__dict__.items()
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self._attributes():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
+                result[key] = format_timestamp(value)
             else:
                 result[key] = value
         return result
 
     @classmethod
-    def load_from_file(cls):
-        """ Load all objects from file
+    def _snapshot_path(cls) -> str:
+        """ Path of the snapshot file of the class
+        """
+        return ".db_{}.{}".format(cls.__name__,
+                                  SNAPSHOT_EXTENSIONS[cls.snapshot_format])
+
+    @staticmethod
+    def _json_attributes(attributes: dict) -> dict:
+        """ Attributes read from a snapshot, as in a JSON snapshot
+        """
+        return {key: format_timestamp(value) if type(value) is datetime
+                else value for key, value in attributes.items()}
+
+    @staticmethod
+    def _binary_attributes(attributes: dict) -> dict:
+        """ Attributes read from a snapshot, as in a binary snapshot:
+        with the timestamps that round-trip exactly parsed
+        """
+        attributes = dict(attributes)
+        for key in TIMESTAMP_ATTRIBUTES:
+            value = attributes.get(key)
+            if type(value) is not str:
+                continue
+            try:
+                timestamp = parse_timestamp(value)
+            except ValueError:
+                continue
+            if format_timestamp(timestamp) == value:
+                attributes[key] = timestamp
+        return attributes
+
+    @classmethod
+    def _storage(cls) -> Any:
+        """ Storage engine of the class, None for the "file" storage
+        """
+        if cls.storage == "file":
+            return None
+        storage = _storages.get(cls.storage)
+        if storage is None:
+            with _WRITE_LOCK:
+                storage = _storages.get(cls.storage)
+                if storage is None:
+                    storage = _storages[cls.storage] = \
+                        STORAGE_ENGINES[cls.storage]()
+        return storage
+
+    @classmethod
+    def load_from_file(cls, lazy: bool = None):
+        """ Load all objects from file, then replay the journal
+        The file is parsed incrementally. In lazy mode (LOAD_MODE=lazy
+        by default) objects are only built on first access.
+        """
+        if cls._storage() is not None:
+            return
+        s_class = cls.__name__
+        file_path = cls._snapshot_path()
+        if lazy is None:
+            lazy = LOAD_MODE == "lazy"
+        with cls._exclusive():
+            cls.flush()
+            with cls._file_lock(shared=True), cls._resetting_indexes():
+                JOURNALS[s_class] = 0
+                state = FILE_STATES.setdefault(s_class, {})
+                state.update(journal=None, offset=0,
+                             checked=time.monotonic())
+                _hold_snapshot(state, file_path)
+                if cls.snapshot_format == "binary":
+                    cls._load_binary(file_path, lazy)
+                else:
+                    cls._load_json(file_path, lazy)
+                damaged = cls.replay_journal()
+            if damaged:
+                cls.save_to_file()
+
+    @classmethod
+    def _load_binary(cls, file_path: str, lazy: bool):
+        """ Load the objects of a binary snapshot
+        In lazy mode only the index and the indexed and sorted
+        attributes are read.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
         if not path.exists(file_path):
+            DATA[s_class] = LazyStore(cls, json.loads) if lazy else {}
+            return
+        snapshot = BinarySnapshot(file_path)
+        objs = DATA[s_class] = LazyStore(cls, snapshot.read) if lazy \
+            else {}
+        names = list(cls._keyed_attributes())
+        for obj_id, offset in snapshot.offsets.items():
+            if lazy:
+                dict.__setitem__(objs, obj_id, offset)
+                if names:
+                    cls._index_json(obj_id, snapshot.read(offset, names))
+            else:
+                objs[obj_id] = obj = cls(**snapshot.read(offset))
+                obj._index()
+        if not lazy:
+            snapshot.close()
+
+    @classmethod
+    def _load_json(cls, file_path: str, lazy: bool):
+        """ Load the objects of a JSON snapshot, parsed incrementally
+        """
+        s_class = cls.__name__
+        objs = DATA[s_class] = LazyStore(cls, json.loads) if lazy else {}
+        if path.exists(file_path):
+            with open(file_path, 'r') as f:
+                for obj_id, obj_json, text in iter_json_entries(f, raw=True):
+                    cls._index_entry(obj_id, add=False)
+                    if lazy:
+                        # The text takes a fraction of the memory of
+                        # the parsed dict.
+                        dict.__setitem__(objs, obj_id, text)
+                        cls._index_json(obj_id, obj_json)
+                    else:
+                        objs[obj_id] = obj = cls(**obj_json)
+                        obj._index()
+
+    @classmethod
+    def replay_journal(cls) -> bool:
+        """ Apply the journal records to DATA
+        Return True if a damaged record (e.g. a write cut short by a
+        crash) was skipped, in which case the journal must be compacted
+        before anything is appended to it.
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        state = FILE_STATES.get(s_class, {})
+        state.update(journal=None, offset=0)
+        if not path.exists(journal_path):
+            return False
+
+        with open(journal_path, 'rb') as f:
+            data = f.read()
+            state['journal'] = os.fstat(f.fileno()).st_ino
+        end = data.rfind(b"\n") + 1
+        state['offset'] = end
+        # A last line without newline is incomplete
+        return cls._apply_journal(data[:end]) or end < len(data)
+
+    @classmethod
+    def _apply_journal(cls, data: bytes, keep: Iterable[str] = ()) -> bool:
+        """ Apply the journal records of data (complete lines) to DATA,
+        except those of the objects of keep
+        Return True if a damaged record was skipped.
+        """
+        s_class = cls.__name__
+        damaged = False
+        with _WRITE_LOCK:
+            for line in data.split(b"\n")[:-1]:
+                try:
+                    record = json.loads(line)
+                    obj_id = record['id']
+                    if obj_id in keep:
+                        pass
+                    elif record['op'] == "save":
+                        cls._put(obj_id, record['obj'])
+                    else:
+                        cls._drop(obj_id)
+                except (ValueError, KeyError, TypeError):
+                    damaged = True
+                    continue
+                JOURNALS[s_class] = JOURNALS.get(s_class, 0) + 1
+        return damaged
+
+    @classmethod
+    @contextmanager
+    def _file_lock(cls, shared: bool = False) -> Iterator[None]:
+        """ Hold the flock() of the files of the class: shared to read
+        them, exclusive to write them; reentrant within the process
+        """
+        s_class = cls.__name__
+        with _WRITE_LOCK:
+            held = _file_locks.get(s_class)
+            if held is not None:
+                if held[1] and not shared:
+                    fcntl.flock(held[0], fcntl.LOCK_EX)
+                    held[1] = False
+                yield
+                return
+            with open(".db_{}.lock".format(s_class), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                _file_locks[s_class] = [f, shared]
+                try:
+                    yield
+                finally:
+                    del _file_locks[s_class]
+
+    @classmethod
+    def _files_changed(cls, state: dict) -> bool:
+        """ Whether the files of the class changed since state
+        """
+        if _file_id(cls._snapshot_path()) != state['snapshot']:
+            return True
+        journal = _file_id(".db_{}.journal".format(cls.__name__))
+        if journal is None:
+            return state['journal'] is not None
+        return journal[0] != state['journal'] or \
+            journal[1] > state['offset']
+
+    @classmethod
+    def refresh(cls):
+        """ Apply the changes other processes made to the files of the
+        class since it was loaded or refreshed, if any
+        Costs two stat() calls when nothing changed; otherwise only the
+        objects that changed are rebuilt, and objects with pending
+        changes are kept as they are.
+        """
+        if cls._storage() is not None:
+            return
+        state = FILE_STATES.get(cls.__name__)
+        if state is None:
+            return
+        now = time.monotonic()
+        if now - state['checked'] < REFRESH_INTERVAL:
+            return
+        state['checked'] = now
+        if cls._files_changed(state):
+            with cls._file_lock(shared=True):
+                cls._refresh()
+
+    @classmethod
+    def _refresh(cls, keep: Iterable[str] = ()):
+        """ Apply the changes of the files of the class since the last
+        load or refresh, except to the objects of keep and to those
+        with pending changes; the caller holds the file lock
+        If the snapshot changed (rewritten by another process), it is
+        compared with DATA object by object, then the journal is read
+        from its start; otherwise only its new records are read.
+        """
+        s_class = cls.__name__
+        state = FILE_STATES.get(s_class)
+        if state is None:
             return
+        keep = set(keep)
+        keep.update(PENDING.get(cls, ()))
+        if _file_id(cls._snapshot_path()) != state['snapshot']:
+            _hold_snapshot(state, cls._snapshot_path())
+            cls._refresh_snapshot(keep)
+            state.update(journal=None, offset=0)
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        journal_path = ".db_{}.journal".format(s_class)
+        journal = _file_id(journal_path)
+        if journal is None:
+            state.update(journal=None, offset=0)
+            return
+        if journal[0] != state['journal']:
+            state.update(journal=journal[0], offset=0)
+        if journal[1] <= state['offset']:
+            return
+        with open(journal_path, 'rb') as f:
+            f.seek(state['offset'])
+            data = f.read()
+        # Stop before a record being written
+        end = data.rfind(b"\n") + 1
+        cls._apply_journal(data[:end], keep)
+        state['offset'] += end
+
+    @classmethod
+    def _refresh_snapshot(cls, keep: set):
+        """ Update DATA from the snapshot file, except the objects of keep
+        """
+        s_class = cls.__name__
+        file_path = cls._snapshot_path()
+        objs = DATA[s_class]
+        # The JSON text of changed objects is kept as is by lazy stores
+        # of JSON snapshots
+        lazy = isinstance(objs, LazyStore) and objs.decode is json.loads
+        seen = set()
+        with _WRITE_LOCK:
+            if not path.exists(file_path):
+                pass
+            elif cls.snapshot_format == "binary":
+                snapshot = BinarySnapshot(file_path)
+                try:
+                    for obj_id, attributes in snapshot.items():
+                        seen.add(obj_id)
+                        if obj_id not in keep:
+                            cls._put(obj_id,
+                                     cls._json_attributes(attributes))
+                finally:
+                    snapshot.close()
+            else:
+                with open(file_path, 'r') as f:
+                    for obj_id, obj_json, text in iter_json_entries(
+                            f, raw=True):
+                        seen.add(obj_id)
+                        if obj_id not in keep:
+                            cls._put(obj_id, obj_json,
+                                     text if lazy else None)
+            for obj_id in list(objs):
+                if obj_id not in seen and obj_id not in keep:
+                    cls._drop(obj_id)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
+        The snapshot is written to a temporary file and renamed, so a
+        crash leaves either the old or the new snapshot; the journal,
+        now part of the snapshot, is emptied afterwards.
+        """
+        if cls._storage() is not None:
+            return
+        s_class = cls.__name__
+        file_path = cls._snapshot_path()
+        with _WRITE_LOCK, cls._file_lock():
+            objs = DATA[s_class]
+            tmp_path = "{}.tmp".format(file_path)
+            if cls.snapshot_format == "binary":
+                with open(tmp_path, 'wb') as f:
+                    write_snapshot(f, (
+                        (obj_id, dict(obj._attributes())
+                         if isinstance(obj, Base) else
+                         cls._binary_attributes(objs.decode(obj)))
+                        for obj_id, obj in list(dict.items(objs))))
+            else:
+                with open(tmp_path, 'w') as f:
+                    f.write("{")
+                    separator = ""
+                    for obj_id, obj in list(dict.items(objs)):
+                        if isinstance(obj, Base):
+                            obj = json.dumps(obj.to_json(True))
+                        elif type(obj) is not str:
+                            obj = json.dumps(cls._json_attributes(
+                                objs.decode(obj)))
+                        f.write("{}{}: {}".format(
+                            separator, json.dumps(obj_id), obj))
+                        separator = ", "
+                    f.write("}")
+            state = FILE_STATES.get(s_class)
+            if state is not None:
+                _hold_snapshot(state, tmp_path)
+            os.replace(tmp_path, file_path)
+
+            journal_path = ".db_{}.journal".format(s_class)
+            if path.exists(journal_path):
+                os.remove(journal_path)
+            JOURNALS[s_class] = 0
+            if state is not None:
+                state.update(journal=None, offset=0)
+
+    @classmethod
+    def append_to_journal(cls, changes: Iterable[tuple]):
+        """ Append one record per ("save" | "remove", id) change to the
+        journal, with a single write, compacting it when it grows past
+        the number of objects
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        lines = []
+        for op, obj_id in changes:
+            record = {'op': op, 'id': obj_id}
+            if op == "save":
+                obj = DATA[s_class].get(obj_id)
+                if obj is None:
+                    continue
+                record['obj'] = obj.to_json(True)
+            lines.append(json.dumps(record) + "\n")
+        if not lines:
+            return
+        data = "".join(lines).encode()
+        with _WRITE_LOCK, cls._file_lock():
+            with open(".db_{}.journal".format(s_class), 'ab') as f:
+                f.write(data)
+                f.flush()
+                end = f.tell()
+                journal = os.fstat(f.fileno()).st_ino
+            # Skip our records on refresh, when nothing came before them
+            state = FILE_STATES.get(s_class)
+            if state is not None and state['offset'] == end - len(data) \
+                    and state['journal'] in (None, journal):
+                state.update(journal=journal, offset=end)
+            JOURNALS[s_class] = JOURNALS.get(s_class, 0) + len(lines)
+            if JOURNALS[s_class] > max(JOURNAL_COMPACT_MIN,
+                                       len(DATA[s_class])):
+                cls.save_to_file()
+
+    def _persist(self, op: str):
+        """ Write a save or remove of this object to disk, or queue it
+        according to the durability of the class
+        """
+        cls = self.__class__
+        if self.durability == "sync":
+            cls._write([(op, self.id)])
+            return
+        with _WRITE_LOCK:
+            pending = PENDING.setdefault(cls, {})
+            pending.pop(self.id, None)
+            pending[self.id] = op
+            full = len(pending) >= FLUSH_BATCH
+        if self.durability == "interval":
+            _start_flusher()
+            if full:
+                cls.flush()
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _write(cls, changes: List[tuple]):
+        """ Write changes with the persistence of the class, after the
+        changes of other processes
+        """
+        with _WRITE_LOCK, cls._file_lock():
+            cls._refresh(obj_id for _, obj_id in changes)
+            if cls.persistence == "journal":
+                cls.append_to_journal(changes)
+            else:
+                cls.save_to_file()
+
+    @classmethod
+    def flush(cls):
+        """ Write the pending changes of the class to disk; they stay
+        pending if that fails
+        """
+        with _WRITE_LOCK:
+            pending = PENDING.pop(cls, None)
+            if not pending:
+                return
+            try:
+                cls._write([(op, obj_id) for obj_id, op
+                            in pending.items()])
+            except BaseException:
+                # Changes queued since then are newer
+                newer = PENDING.pop(cls, {})
+                for obj_id in newer:
+                    pending.pop(obj_id, None)
+                pending.update(newer)
+                PENDING[cls] = pending
+                raise
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        storage = self._storage()
+        if storage is not None:
+            storage.save(self)
+            return
+        with _WRITE_LOCK:
+            objs = DATA[s_class]
+            self._reindex(self.id, self._entry_keys(self.id), self._keys(),
+                          partial(dict.__setitem__, objs, self.id, self))
+            self._persist("save")
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        storage = self._storage()
+        if storage is not None:
+            storage.remove(self)
+            return
+        with _WRITE_LOCK:
+            if self._drop(self.id):
+                self._persist("remove")
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
+        storage = cls._storage()
+        if storage is not None:
+            return storage.count(cls)
         s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        _wait_gate(s_class)
+        return len(DATA[s_class])
 
     @classmethod
-    def all(cls) -> Iterable[TypeVar('Base')]:
+    def all(cls, limit: int = None,
+            after: str = None) -> Iterable[TypeVar('Base')]:
         """ Return all objects
+        With limit or after, return a page instead: at most limit objects
+        (default: no limit) in id order, from the one after the id after
+        (default: the first one), found in O(limit).
         """
-        return cls.search()
+        if limit is None and after is None:
+            return cls.search()
+        storage = cls._storage()
+        if storage is not None:
+            return storage.page(cls, limit, after)
+        s_class = cls.__name__
+        _wait_gate(s_class)
+        objs = DATA[s_class]
+        items = cls._sorted_indexes()['id'].irange(
+            None if after is None else sort_key(after),
+            inclusive=(False, True))
+        page = []
+        for _, obj_id in items:
+            if limit is not None and len(page) >= limit:
+                break
+            obj = objs.get(obj_id)
+            if obj is not None:
+                page.append(obj)
+        return page
 
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
+        storage = cls._storage()
+        if storage is not None:
+            return storage.get(cls, id)
         s_class = cls.__name__
+        _wait_gate(s_class)
         return DATA[s_class].get(id)
 
     @classmethod
@@ -126,6 +1160,7 @@ class Base():
         """ Search all objects with matching attributes
         """
         s_class = cls.__name__
+
         def _search(obj):
             if len(attributes) == 0:
                 return True
@@ -133,5 +1168,194 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        storage = cls._storage()
+        if storage is not None:
+            return list(filter(_search, storage.candidates(cls, attributes)))
+        _wait_gate(s_class)
+        objs = DATA[s_class]
+        candidates = None
+        for k, v in attributes.items():
+            if k in cls.indexed_attributes:
+                key = cls._index_key(k, v)
+                if _hashable(key):
+                    bucket = cls._indexes()[k].get(key, {})
+                    # An id may be found before its object is saved or
+                    # after it is removed: get() skips it then.
+                    candidates = [obj for obj in map(objs.get, list(bucket))
+                                  if obj is not None]
+                    break
+        if candidates is None:
+            candidates = list(objs.values())
+        return list(filter(_search, candidates))
+
+    @classmethod
+    def _query_plan(cls, attributes: dict, prefixes: dict, ranges: dict,
+                    order_by: str) -> tuple:
+        """ How query finds its candidates:
+        - ("equal", attribute, key): in the index bucket of an equality
+        - ("scan", attribute, minimum, maximum): in the sorted index of
+          an attribute, between two sort values (maximum excluded, None:
+          no bound), for a prefix or a range, preferably of order_by,
+          else for the order
+        - ("all",): among all the objects
+        """
+        for name, value in attributes.items():
+            if name in cls.indexed_attributes:
+                key = cls._index_key(name, value)
+                if _hashable(key):
+                    return ("equal", name, key)
+        sorted_names = ('id',) + tuple(cls.sorted_attributes)
+        scans = []
+        for name, prefix in prefixes.items():
+            prefix = cls._sort_value(name, prefix)
+            if name in sorted_names and type(prefix) is str:
+                scans.append(("scan", name, prefix, prefix_end(prefix)))
+        for name, (minimum, maximum) in ranges.items():
+            if name in sorted_names:
+                scans.append(("scan", name,
+                              cls._sort_value(name, minimum),
+                              cls._sort_value(name, maximum)))
+        for scan in scans:
+            if scan[1] == order_by:
+                return scan
+        if scans:
+            return scans[0]
+        if order_by in sorted_names:
+            return ("scan", order_by, None, None)
+        return ("all",)
+
+    @classmethod
+    def _query_candidates(cls, plan: tuple,
+                          descending: bool) -> Iterator[TypeVar('Base')]:
+        """ Objects of the file storage that may match a query, found as
+        plan says (in the order of the sorted index for a scan)
+        """
+        objs = DATA[cls.__name__]
+        if plan[0] == "all":
+            yield from list(objs.values())
+            return
+        if plan[0] == "equal":
+            ids = list(cls._indexes()[plan[1]].get(plan[2], {}))
+        else:
+            name, minimum, maximum = plan[1:]
+            # Items of a value follow its sort_key, and precede the
+            # sort_key of any greater value
+            bounds = [None if value is None else sort_key(value)
+                      for value in (minimum, maximum)]
+            items = cls._sorted_indexes()[name].irange(
+                *bounds, inclusive=(True, False), reverse=descending)
+            # The id follows the sort_key of the value
+            ids = (item[-1] for item in items)
+        for obj_id in ids:
+            obj = objs.get(obj_id)
+            if obj is not None:
+                yield obj
+
+    @classmethod
+    def query(cls, attributes: dict = {}, prefixes: dict = {},
+              ranges: dict = {}, order_by: str = 'id',
+              descending: bool = False,
+              limit: int = None) -> List[TypeVar('Base')]:
+        """ Search objects with attributes equal to attributes, starting
+        with prefixes (attribute -> prefix) and within ranges (attribute
+        -> (minimum, maximum), minimum included, maximum excluded, None:
+        no bound); return at most limit of them (default: no limit),
+        ordered by order_by
+        Prefixes, ranges and orders compare values as sorted indexes do
+        (normalised, see sorted_attributes, and with sort_key). When the
+        candidates come from the sorted index of order_by, the query
+        stops after limit matches; otherwise they are sorted.
+        """
+        plan = cls._query_plan(attributes, prefixes, ranges, order_by)
+        storage = cls._storage()
+        if storage is not None:
+            candidates = storage.query(cls, plan, descending)
+        else:
+            _wait_gate(cls.__name__)
+            candidates = cls._query_candidates(plan, descending)
+        prefixes = {name: cls._sort_value(name, prefix)
+                    for name, prefix in prefixes.items()}
+        ranges = {name: [None if value is None else
+                         sort_key(cls._sort_value(name, value))
+                         for value in bounds]
+                  for name, bounds in ranges.items()}
+
+        def _match(obj):
+            for name, value in attributes.items():
+                if getattr(obj, name, None) != value:
+                    return False
+            for name, prefix in prefixes.items():
+                value = cls._sort_value(name, getattr(obj, name, None))
+                if type(value) is not str or type(prefix) is not str or \
+                        not value.startswith(prefix):
+                    return False
+            for name, (minimum, maximum) in ranges.items():
+                key = sort_key(cls._sort_value(name,
+                                               getattr(obj, name, None)))
+                if minimum is not None and key < minimum or \
+                        maximum is not None and key >= maximum:
+                    return False
+            return True
+
+        ordered = plan[0] == "scan" and plan[1] == order_by
+        results = []
+        seen = set()
+        for obj in candidates:
+            # An object moving in a sorted index may be found twice
+            if obj.id in seen or not _match(obj):
+                continue
+            seen.add(obj.id)
+            results.append(obj)
+            if ordered and limit is not None and len(results) >= limit:
+                break
+        if not ordered:
+            results.sort(key=lambda obj: cls._sort_item(
+                order_by, getattr(obj, order_by, None), sort_key(obj.id)),
+                reverse=descending)
+        return results if limit is None else results[:limit]
+
+
+def flush_all():
+    """ Write the pending changes of every class to disk; raise the
+    first error once every class was tried
+    """
+    with _WRITE_LOCK:
+        classes = list(PENDING)
+    error = None
+    for cls in classes:
+        try:
+            cls.flush()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+
+
+def _flush_periodically():
+    """ Flusher thread of the "interval" durability
+    """
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush_all()
+        except Exception:
+            logging.getLogger(__name__).exception(
+                "Failed to write the pending changes, retrying in %ss",
+                FLUSH_INTERVAL)
+
+
+def _start_flusher():
+    """ Start the flusher thread if it is not running yet
+    """
+    global _flusher
+    if _flusher is None:
+        with _WRITE_LOCK:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_periodically,
+                                            name="base-flusher",
+                                            daemon=True)
+                _flusher.start()
+
+
+atexit.register(flush_all)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+""" Binary snapshot module
+
+Layout of a .db_<Class>.bin file (little-endian):
+
+    header   magic "BSNP", version (H), count (I),
+             tables offset (Q), index offset (Q)
+    records  one per object: body length (I), layout number (H), the
+             fixed size values of the layout, then the UTF-8 text of
+             its string values, one after the other
+    tables   the attribute names: count (I), then length (I) and UTF-8
+             bytes of each name; the layouts: count (I), then number of
+             attributes (H) and, per attribute, name number (H) and
+             type tag (B) of each layout
+    index    the byte length (H) of each id, the offset (Q) of each
+             record, then the UTF-8 bytes of all the ids
+
+A layout lists the attributes of a record with the type of their
+values, so that objects with the same attributes share it. Values are
+stored by type: None and booleans in the type tag, 64-bit integers and
+floats as is, naive datetimes as year (H), month, day, hour, minute and
+second (B), strings as the offset in characters of the end of their
+text (I) among the fixed size values and their text after them,
+anything else as JSON text like a string.
+
+Only the header, the tables and the index are read when the file is
+opened; records are decoded one at a time, from an mmap of the file,
+with one unpack for their fixed size values and one UTF-8 decode for
+their text.
+"""
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Tuple
+import json
+import mmap
+import struct
+import sys
+
+
+MAGIC = b"BSNP"
+VERSION = 1
+HEADER = struct.Struct("<4sHIQQ")
+
+NONE, FALSE, TRUE, INT, FLOAT, STR, DATETIME, JSON = range(8)
+# Fixed size value of each type tag, if any
+FORMATS = {INT: "q", FLOAT: "d", STR: "I", DATETIME: "HBBBBB", JSON: "I"}
+
+_U32 = struct.Struct("<I")
+_RECORD = struct.Struct("<IH")
+_LAYOUT = struct.Struct("<H")
+_FIELD = struct.Struct("<HB")
+_INT_MIN, _INT_MAX = -1 << 63, (1 << 63) - 1
+
+
+def _little_endian(values: array) -> bytes:
+    """ Bytes of an array in little-endian order
+    """
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    """ Array of typecode values read from little-endian bytes
+    """
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def encode_value(value: Any) -> Tuple[int, tuple, str]:
+    """ Type tag, fixed size values and text of a value
+    """
+    if value is None:
+        return NONE, (), ""
+    if value is False:
+        return FALSE, (), ""
+    if value is True:
+        return TRUE, (), ""
+    if type(value) is int and _INT_MIN <= value <= _INT_MAX:
+        return INT, (value,), ""
+    if type(value) is float:
+        return FLOAT, (value,), ""
+    if type(value) is str:
+        return STR, (), value
+    if type(value) is datetime and value.tzinfo is None:
+        return DATETIME, (value.year, value.month, value.day, value.hour,
+                          value.minute, value.second), ""
+    return JSON, (), json.dumps(value)
+
+
+def _layout_struct(fields: Tuple[Tuple[Any, int], ...]) -> struct.Struct:
+    """ Struct of the fixed size values of a layout of (name, type tag)
+    fields
+    """
+    return struct.Struct("<" + "".join(FORMATS.get(tag, "")
+                                       for _, tag in fields))
+
+
+def _layout_plan(fields: Tuple[Tuple[str, int], ...]) -> tuple:
+    """ How to decode the records of a layout of (name, type tag) fields:
+    struct of the fixed size values, index of the end of the text among
+    them (None without strings), and per field (name, type tag, index of
+    its first fixed size value, index of the end of the previous string)
+    The fixed size values are indexed from 1: index 0 is the start of
+    the text.
+    """
+    steps = []
+    fixed = 1
+    end = 0
+    for name, tag in fields:
+        steps.append((name, tag, fixed, end))
+        if tag == STR or tag == JSON:
+            end = fixed
+        fixed += len(FORMATS.get(tag, ""))
+    return _layout_struct(fields), end or None, tuple(steps)
+
+
+def write_snapshot(f, entries: Iterable[Tuple[str, Dict[str, Any]]]):
+    """ Write the (id, attributes) entries to the binary file f
+    """
+    f.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+    offset = HEADER.size
+    names = {}
+    # layout -> (number, struct of its fixed size values)
+    layouts = {}
+    ids = []
+    offsets = array("Q")
+    for obj_id, attributes in entries:
+        fields = []
+        fixed = []
+        texts = []
+        end = 0
+        for name, value in attributes.items():
+            tag, values, text = encode_value(value)
+            fields.append((names.setdefault(name, len(names)), tag))
+            if tag == STR or tag == JSON:
+                end += len(text)
+                fixed.append(end)
+                texts.append(text)
+            else:
+                fixed.extend(values)
+        fields = tuple(fields)
+        layout = layouts.get(fields)
+        if layout is None:
+            layout = layouts[fields] = (len(layouts),
+                                        _layout_struct(fields))
+        data = layout[1].pack(*fixed) + \
+            "".join(texts).encode("utf-8", "surrogatepass")
+        f.write(_RECORD.pack(_LAYOUT.size + len(data), layout[0]))
+        f.write(data)
+        ids.append(obj_id)
+        offsets.append(offset)
+        offset += _RECORD.size + len(data)
+
+    tables_offset = offset
+    parts = [_U32.pack(len(names))]
+    for name in names:
+        data = name.encode("utf-8", "surrogatepass")
+        parts.append(_U32.pack(len(data)))
+        parts.append(data)
+    parts.append(_U32.pack(len(layouts)))
+    for fields in layouts:
+        parts.append(_LAYOUT.pack(len(fields)))
+        parts.extend(_FIELD.pack(*field) for field in fields)
+    data = b"".join(parts)
+    f.write(data)
+
+    index_offset = tables_offset + len(data)
+    encoded_ids = [obj_id.encode("utf-8", "surrogatepass")
+                   for obj_id in ids]
+    f.write(_little_endian(array("H", map(len, encoded_ids))))
+    f.write(_little_endian(offsets))
+    f.write(b"".join(encoded_ids))
+
+    f.seek(0)
+    f.write(HEADER.pack(MAGIC, VERSION, len(ids), tables_offset,
+                        index_offset))
+
+
+class BinarySnapshot():
+    """ Read access to a binary snapshot file through mmap
+    offsets maps the id of every object to the offset of its record,
+    to be decoded with read().
+    """
+
+    def __init__(self, file_path: str):
+        """ Open a snapshot and read its tables and index
+        """
+        with open(file_path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        if len(mm) < HEADER.size:
+            raise ValueError("Truncated binary snapshot")
+        magic, version, count, tables_offset, index_offset = \
+            HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a binary snapshot (version {})"
+                             .format(VERSION))
+
+        pos = tables_offset
+        count_names, = _U32.unpack_from(mm, pos)
+        pos += _U32.size
+        names = []
+        for _ in range(count_names):
+            size, = _U32.unpack_from(mm, pos)
+            pos += _U32.size
+            names.append(mm[pos:pos + size].decode("utf-8",
+                                                   "surrogatepass"))
+            pos += size
+        count_layouts, = _U32.unpack_from(mm, pos)
+        pos += _U32.size
+        self.layouts = []
+        for _ in range(count_layouts):
+            size, = _LAYOUT.unpack_from(mm, pos)
+            pos += _LAYOUT.size
+            fields = tuple(_FIELD.unpack_from(mm, pos + i * _FIELD.size)
+                           for i in range(size))
+            pos += size * _FIELD.size
+            self.layouts.append(_layout_plan(
+                tuple((names[number], tag) for number, tag in fields)))
+
+        pos = index_offset
+        lengths = _from_little_endian("H", mm[pos:pos + 2 * count])
+        pos += 2 * count
+        offsets = _from_little_endian("Q", mm[pos:pos + 8 * count])
+        pos += 8 * count
+        ids = []
+        for size in lengths:
+            ids.append(mm[pos:pos + size].decode("utf-8", "surrogatepass"))
+            pos += size
+        self.offsets = dict(zip(ids, offsets))
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def read(self, offset: int, names: Iterable[str] = None) -> dict:
+        """ Decode the record at offset into a dictionary of its
+        attributes, or only of the attributes in names
+        """
+        mm = self._mm
+        size, number = _RECORD.unpack_from(mm, offset)
+        layout, end, steps = self.layouts[number]
+        start = offset + _RECORD.size
+        fixed = (0, *layout.unpack_from(mm, start))
+        text = mm[start + layout.size:offset + _U32.size + size].decode(
+            "utf-8", "surrogatepass")
+        if len(text) != (0 if end is None else fixed[end]):
+            raise ValueError("Damaged binary snapshot record")
+        result = {}
+        for name, tag, i, previous in steps:
+            if names is not None and name not in names:
+                continue
+            if tag == STR:
+                result[name] = text[fixed[previous]:fixed[i]]
+            elif tag == DATETIME:
+                result[name] = datetime(fixed[i], fixed[i + 1],
+                                        fixed[i + 2], fixed[i + 3],
+                                        fixed[i + 4], fixed[i + 5])
+            elif tag == INT or tag == FLOAT:
+                result[name] = fixed[i]
+            elif tag == JSON:
+                result[name] = json.loads(text[fixed[previous]:fixed[i]])
+            elif tag <= TRUE:
+                result[name] = (None, False, True)[tag]
+            else:
+                raise ValueError("Unknown value type {}".format(tag))
+        return result
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        """ Yield the (id, attributes) pairs of all the records
+        """
+        for obj_id, offset in self.offsets.items():
+            yield obj_id, self.read(offset)
+
+    def close(self):
+        """ Unmap the file
+        """
+        self._mm.close()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+""" Sorted index module
+
+A SortedIndex keeps items in order in blocks of LOAD to 2 * LOAD items
+(fewer for the last ones), with the last item of every block in a
+separate list, so that finding an item is two bisections and adding or
+removing one moves the pointers of a block, not of the whole index.
+
+Writers insert an item in, or delete it from, its block in place, an
+operation atomic under the GIL. Splits and merges build new blocks, and
+new lists of blocks and of last items, published with one assignment;
+the blocks they replace are not changed anymore. Readers take the lists
+of the last published state and copy every block before reading it, so
+they iterate without locks and see every item present from start to end
+once. Writers must be serialised by the caller.
+
+Items of different types do not compare: sort_key maps any value to a
+tuple that does, ordering None first, then numbers, strings, naive and
+aware datetimes, and anything else by repr().
+"""
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+import math
+
+
+LOAD = 256
+
+
+def sort_key(value: Any) -> tuple:
+    """ Key of a value that compares with the key of any other value
+    """
+    if value is None:
+        return (0, 0)
+    if type(value) in (bool, int) or \
+            (type(value) is float and not math.isnan(value)):
+        return (1, value)
+    if type(value) is str:
+        return (2, value)
+    if type(value) is datetime:
+        if value.tzinfo is None:
+            return (3, value)
+        return (4, value)
+    return (5, repr(value))
+
+
+def prefix_end(prefix: str) -> Optional[str]:
+    """ Smallest string greater than every string starting with prefix
+    (None if there is none): strings with the prefix are those from
+    prefix included to prefix_end(prefix) excluded
+    """
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if code == 0xD800:
+            # Skip the surrogates, which cannot be encoded
+            code = 0xE000
+        if code <= 0x10FFFF:
+            return prefix[:-1] + chr(code)
+        prefix = prefix[:-1]
+    return None
+
+
+def _blocks(items: List[Any]) -> Tuple[list, list, int]:
+    """ State of an index of sorted items
+    """
+    blocks = [items[i:i + LOAD] for i in range(0, len(items), LOAD)]
+    return [block[-1] for block in blocks], blocks, len(items)
+
+
+class SortedIndex():
+    """ Sorted set of items, copied on write
+    Between defer() and build(), changes are only collected, to sort
+    all the items at once (e.g. while loading).
+    """
+
+    def __init__(self, items: Iterable[Any] = ()):
+        self._state = _blocks(sorted(set(items)))
+        self._deferred = None
+
+    def __len__(self) -> int:
+        return self._state[2]
+
+    def __iter__(self) -> Iterator[Any]:
+        return self.irange()
+
+    def defer(self):
+        """ Collect the changes until build()
+        """
+        self._deferred = dict.fromkeys(self.irange())
+
+    def build(self):
+        """ Sort and publish the changes collected since defer()
+        """
+        self._state = _blocks(sorted(self._deferred))
+        self._deferred = None
+
+    def add(self, item: Any):
+        """ Add an item
+        """
+        if self._deferred is not None:
+            self._deferred[item] = None
+            return
+        maxes, blocks, count = self._state
+        if not blocks:
+            self._state = [item], [[item]], 1
+            return
+        i = min(bisect_left(maxes, item), len(maxes) - 1)
+        block = blocks[i]
+        j = bisect_left(block, item)
+        if j < len(block) and block[j] == item:
+            return
+        if len(block) < 2 * LOAD:
+            block.insert(j, item)
+            if j == len(block) - 1:
+                maxes[i] = item
+            self._state = maxes, blocks, count + 1
+            return
+        block = block.copy()
+        block.insert(j, item)
+        half = len(block) // 2
+        maxes = list(maxes)
+        blocks = list(blocks)
+        blocks[i:i + 1] = [block[:half], block[half:]]
+        maxes[i:i + 1] = [block[half - 1], block[-1]]
+        self._state = maxes, blocks, count + 1
+
+    def discard(self, item: Any):
+        """ Remove an item, if present
+        """
+        if self._deferred is not None:
+            self._deferred.pop(item, None)
+            return
+        maxes, blocks, count = self._state
+        i = bisect_left(maxes, item)
+        if i == len(maxes):
+            return
+        block = blocks[i]
+        j = bisect_left(block, item)
+        if j == len(block) or block[j] != item:
+            return
+        if len(block) > LOAD // 2 or len(blocks) == 1 and len(block) > 1:
+            del block[j]
+            if j == len(block):
+                maxes[i] = block[-1]
+            self._state = maxes, blocks, count - 1
+            return
+        block = block.copy()
+        del block[j]
+        maxes = list(maxes)
+        blocks = list(blocks)
+        if len(blocks) > 1:
+            # Merge with a neighbour, splitting again if too large
+            if i > 0:
+                i -= 1
+                block = blocks[i] + block
+            else:
+                block = block + blocks[i + 1]
+            merged = [block]
+            if len(block) > 2 * LOAD:
+                half = len(block) // 2
+                merged = [block[:half], block[half:]]
+            blocks[i:i + 2] = merged
+            maxes[i:i + 2] = [part[-1] for part in merged]
+        else:
+            del blocks[i]
+            del maxes[i]
+        self._state = maxes, blocks, count - 1
+
+    def irange(self, minimum: Any = None, maximum: Any = None,
+               inclusive: Tuple[bool, bool] = (True, True),
+               reverse: bool = False) -> Iterator[Any]:
+        """ Iterate the items between minimum and maximum (None: no
+        bound), in order or in reverse order
+        """
+        maxes, blocks, _ = self._state
+        if not blocks:
+            return
+        if reverse:
+            yield from self._irange_reverse(maxes, blocks, minimum,
+                                            maximum, inclusive)
+            return
+        if minimum is None:
+            i = j = 0
+        else:
+            j = None
+            find = bisect_left if inclusive[0] else bisect_right
+            i = find(maxes, minimum)
+            if i == len(maxes):
+                return
+        for i in range(i, len(blocks)):
+            block = blocks[i][:]
+            if j is None:
+                j = find(block, minimum)
+            for k in range(j, len(block)):
+                item = block[k]
+                if maximum is not None and (
+                        item > maximum or
+                        not inclusive[1] and item == maximum):
+                    return
+                yield item
+            j = 0
+
+    @staticmethod
+    def _irange_reverse(maxes: list, blocks: list, minimum: Any,
+                        maximum: Any,
+                        inclusive: Tuple[bool, bool]) -> Iterator[Any]:
+        """ irange in reverse order
+        """
+        if maximum is None:
+            i = len(blocks) - 1
+        else:
+            find = bisect_right if inclusive[1] else bisect_left
+            i = min(bisect_left(maxes, maximum), len(maxes) - 1)
+        while i >= 0:
+            block = blocks[i][:]
+            j = len(block) if maximum is None else find(block, maximum)
+            for k in range(j - 1, -1, -1):
+                item = block[k]
+                if minimum is not None and (
+                        item < minimum or
+                        not inclusive[0] and item == minimum):
+                    return
+                yield item
+            i -= 1
+            # The blocks before only hold smaller items
+            maximum = None
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+""" SQLite storage module
+
+Keeps the objects of every class in one table of a SQLite database
+instead of DATA and the .db_<Class>.json files:
+
+    CREATE TABLE "<Class>" (id TEXT PRIMARY KEY, data TEXT NOT NULL,
+                            "key_<attribute>", ...,
+                            "sort_<attribute>", ...)
+
+data is the JSON of the object (to_json(True)); every indexed attribute
+of the class has a key_<attribute> column holding its index key, with
+an index on it, and every sorted attribute a sort_<attribute> column
+holding its sort value (timestamps as text), with an index on it and
+id. Columns missing from a table created by an older version are added
+and filled on first use. The database is opened in WAL mode, so that
+several processes (e.g. WSGI workers) can read it while one of them
+writes.
+Statements are constant SQL with ? parameters, prepared once per
+connection by the statement cache of sqlite3.
+"""
+from datetime import datetime
+from os import getenv
+from typing import Any, Iterable, Iterator, List, Optional
+import json
+import sqlite3
+import threading
+
+
+_INT_MIN, _INT_MAX = -1 << 63, (1 << 63) - 1
+
+
+def _bindable(value: Any) -> bool:
+    """ Whether a value can be stored in, and compared with, a column
+    """
+    if type(value) is int or type(value) is bool:
+        return _INT_MIN <= value <= _INT_MAX
+    return value is None or type(value) in (str, float)
+
+
+def _sortable(value: Any) -> Any:
+    """ Value of a sort column: ordered by SQLite like sort_key orders
+    the value, for None, numbers, strings and naive datetimes (NULL for
+    the others)
+    """
+    if type(value) is datetime:
+        if value.tzinfo is not None:
+            return None
+        return value.isoformat(timespec='seconds')
+    return value if _bindable(value) else None
+
+
+def _quote(name: str) -> str:
+    """ SQL identifier of a name
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class SQLiteStorage():
+    """ Storage engine of the classes whose storage is "sqlite"
+
+    Args:
+        file_path (str): The database file (default: the SQLITE_PATH
+        environment variable, or .db.sqlite3).
+    """
+
+    def __init__(self, file_path: str = None):
+        self.file_path = file_path or getenv("SQLITE_PATH", ".db.sqlite3")
+        self._local = threading.local()
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.file_path, timeout=30,
+                                         isolation_level=None,
+                                         cached_statements=256)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _table(self, cls: type) -> dict:
+        """ SQL statements of the table of a class, created if needed
+        """
+        s_class = cls.__name__
+        table = self._tables.get(s_class)
+        if table is not None:
+            return table
+        with self._lock:
+            table = self._tables.get(s_class)
+            if table is not None:
+                return table
+            name = _quote(s_class)
+            keys = [_quote("key_" + attribute)
+                    for attribute in cls.indexed_attributes]
+            sorts = {attribute: _quote("sort_" + attribute)
+                     for attribute in cls.sorted_attributes}
+            keys += sorts.values()
+            connection = self._connection()
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS {} (id TEXT PRIMARY KEY, "
+                "data TEXT NOT NULL{})".format(
+                    name, "".join(", " + key for key in keys)))
+            self._add_columns(cls, name, keys)
+            for attribute in cls.indexed_attributes:
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                        _quote("{}_{}".format(s_class, attribute)), name,
+                        _quote("key_" + attribute)))
+            for attribute, key in sorts.items():
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS {} ON {} ({}, id)'.format(
+                        _quote("{}_sort_{}".format(s_class, attribute)),
+                        name, key))
+            sorts['id'] = "id"
+            table = {
+                "save": "INSERT INTO {} (id, data{}) VALUES (?, ?{}) "
+                        "ON CONFLICT (id) DO UPDATE SET "
+                        "data = excluded.data{}".format(
+                            name, "".join(", " + key for key in keys),
+                            ", ?" * len(keys),
+                            "".join(", {0} = excluded.{0}".format(key)
+                                    for key in keys)),
+                "remove": "DELETE FROM {} WHERE id = ?".format(name),
+                "get": "SELECT data FROM {} WHERE id = ?".format(name),
+                "count": "SELECT COUNT(*) FROM {}".format(name),
+                "all": "SELECT data FROM {} ORDER BY rowid".format(name),
+                "page": "SELECT data FROM {} ORDER BY id LIMIT ?".format(
+                    name),
+                "page_after": "SELECT data FROM {} WHERE id > ? "
+                              "ORDER BY id LIMIT ?".format(name),
+                "search": {
+                    attribute: "SELECT data FROM {} WHERE {} IS ? "
+                               "ORDER BY rowid".format(name, key)
+                    for attribute, key in zip(cls.indexed_attributes,
+                                              keys)},
+                "name": name,
+                "sorts": sorts,
+                "scan": {},
+            }
+            self._tables[s_class] = table
+            return table
+
+    def _add_columns(self, cls: type, name: str, keys: List[str]):
+        """ Add the key and sort columns missing from the table of a
+        class, filled from the objects stored in it
+        """
+        connection = self._connection()
+        info = 'PRAGMA table_info({})'.format(name)
+        columns = {row[1] for row in connection.execute(info)}
+        if all(key[1:-1].replace('""', '"') in columns for key in keys):
+            return
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            columns = {_quote(row[1]) for row in connection.execute(info)}
+            for key in keys:
+                if key not in columns:
+                    connection.execute("ALTER TABLE {} ADD COLUMN {}"
+                                       .format(name, key))
+            rows = connection.execute(
+                "SELECT id, data FROM {}".format(name)).fetchall()
+            connection.executemany(
+                "UPDATE {} SET {} WHERE id = ?".format(
+                    name, ", ".join(key + " = ?" for key in keys)),
+                ((*self._keys(cls(**json.loads(data))), obj_id)
+                 for obj_id, data in rows))
+
+    @staticmethod
+    def _keys(obj: Any) -> List[Any]:
+        """ Values of the key and sort columns of an object
+        """
+        keys = []
+        for name in obj.indexed_attributes:
+            key = obj._index_key(name, getattr(obj, name, None))
+            keys.append(key if _bindable(key) else None)
+        for name in obj.sorted_attributes:
+            keys.append(_sortable(
+                obj._sort_value(name, getattr(obj, name, None))))
+        return keys
+
+    def save(self, obj: Any):
+        """ Insert or update an object
+        """
+        table = self._table(obj.__class__)
+        self._connection().execute(
+            table["save"],
+            (obj.id, json.dumps(obj.to_json(True)), *self._keys(obj)))
+
+    def save_many(self, objs: Iterable[Any]):
+        """ Insert or update objects of the same class in one transaction
+        """
+        objs = list(objs)
+        if not objs:
+            return
+        table = self._table(objs[0].__class__)
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(table["save"], (
+                (obj.id, json.dumps(obj.to_json(True)), *self._keys(obj))
+                for obj in objs))
+
+    def remove(self, obj: Any) -> bool:
+        """ Delete an object; return whether it was stored
+        """
+        table = self._table(obj.__class__)
+        cursor = self._connection().execute(table["remove"], (obj.id,))
+        return cursor.rowcount > 0
+
+    def get(self, cls: type, obj_id: str) -> Optional[Any]:
+        """ Object of a class by id
+        """
+        table = self._table(cls)
+        row = self._connection().execute(table["get"],
+                                         (obj_id,)).fetchone()
+        return None if row is None else cls(**json.loads(row[0]))
+
+    def count(self, cls: type) -> int:
+        """ Number of objects of a class
+        """
+        table = self._table(cls)
+        return self._connection().execute(table["count"]).fetchone()[0]
+
+    def page(self, cls: type, limit: Optional[int],
+             after: Optional[str]) -> List[Any]:
+        """ At most limit objects of a class (None: no limit) in id
+        order, from the one after the id after (None: the first one)
+        """
+        table = self._table(cls)
+        limit = -1 if limit is None else limit
+        if after is None:
+            rows = self._connection().execute(table["page"], (limit,))
+        else:
+            rows = self._connection().execute(table["page_after"],
+                                              (after, limit))
+        return [cls(**json.loads(data)) for data, in rows]
+
+    def candidates(self, cls: type, attributes: dict) -> List[Any]:
+        """ Objects of a class that may match attributes, narrowed with
+        the key column of the first indexed attribute of the query
+        """
+        table = self._table(cls)
+        query, parameters = table["all"], ()
+        for name, value in attributes.items():
+            if name in cls.indexed_attributes:
+                key = cls._index_key(name, value)
+                if _bindable(key):
+                    query, parameters = table["search"][name], (key,)
+                    break
+        rows = self._connection().execute(query, parameters)
+        return [cls(**json.loads(data)) for data, in rows]
+
+    def query(self, cls: type, plan: tuple,
+              descending: bool) -> Iterator[Any]:
+        """ Objects of a class that may match a query, found as plan says
+        (see Base._query_plan), in the order of the sort column for a
+        scan; fetched as they are iterated
+        """
+        if plan[0] == "equal":
+            yield from self.candidates(cls, {plan[1]: plan[2]})
+            return
+        if plan[0] == "all":
+            yield from self.candidates(cls, {})
+            return
+        table = self._table(cls)
+        name, minimum, maximum = plan[1:]
+        # Inclusive bounds: timestamps are compared to the second, and
+        # the caller checks the matches
+        minimum, maximum = _sortable(minimum), _sortable(maximum)
+        shape = (name, minimum is not None, maximum is not None, descending)
+        query = table["scan"].get(shape)
+        if query is None:
+            column = table["sorts"][name]
+            conditions = []
+            if minimum is not None:
+                conditions.append("{} >= ?".format(column))
+            if maximum is not None:
+                conditions.append("({0} <= ? OR {0} IS NULL)".format(column)
+                                  if minimum is None else
+                                  "{} <= ?".format(column))
+            order = " DESC" if descending else ""
+            query = table["scan"][shape] = \
+                "SELECT data FROM {}{} ORDER BY {}".format(
+                    table["name"],
+                    " WHERE " + " AND ".join(conditions)
+                    if conditions else "",
+                    column + order if name == 'id' else
+                    "{}{}, id{}".format(column, order, order))
+        parameters = [value for value in (minimum, maximum)
+                      if value is not None]
+        for data, in self._connection().execute(query, parameters):
+            yield cls(**json.loads(data))
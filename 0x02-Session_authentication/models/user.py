@@ -9,6 +9,11 @@ class User(Base):
     """ User class
     """
 
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    indexed_attributes = {'email': str.lower}
+    sorted_attributes = dict(Base.sorted_attributes, email=str.lower,
+                             last_name=str.lower)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+
+"""
+Multithreaded stress test of the model store.
+
+Fills the store with N users, half of them "stable" (their email never
+changes but they are saved again and again) and half "churned" (their
+email toggles between two values, or they are removed and saved back),
+then runs T threads for D seconds each, for every T, that mix:
+    - get by id, search by email and query by email prefix (the reads)
+    - saves and removes (a fraction of the operations, -w)
+    - a rare all()
+while one more thread rewrites and checks the snapshot file. Reports
+the throughput for every T and the invariants that did not hold:
+    - a stable user is always found by get, by its email and by its
+      email as prefix, once
+    - a search (query) only returns users with the email (prefix)
+      searched, at most once
+    - all() returns every stable user and no duplicates
+    - every snapshot written holds every stable user
+    - no operation raises
+
+Usage:
+    ./stress_store.py [-n USERS] [-t THREADS ...] [-d SECONDS]
+                      [-w WRITES] [--lazy]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+from models import base
+from models.user import User
+
+MAX_ERRORS = 10
+
+
+class Run():
+    """
+    State shared by the threads of a run.
+    """
+
+    def __init__(self, count: int, writes: float, seconds: float):
+        self.count = count
+        self.stable = count // 2
+        self.writes = writes
+        self.deadline = time.monotonic() + seconds
+        self.operations = 0
+        self.snapshots = 0
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def error(self, message: str):
+        """
+        Records an invariant that did not hold.
+        """
+        with self.lock:
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append(message)
+
+    def check_search(self, email: str):
+        """
+        Searches email, checking the results.
+        """
+        found = User.search({"email": email})
+        if len({user.id for user in found}) != len(found) or \
+                any(user.email != email for user in found):
+            self.error("search {}: {}".format(
+                email, [(user.id, user.email) for user in found]))
+        return found
+
+    def check_query(self, prefix: str):
+        """
+        Queries the users whose email starts with prefix, checking the
+        results.
+        """
+        found = User.query(prefixes={"email": prefix}, order_by="email")
+        if len({user.id for user in found}) != len(found) or \
+                any(not user.email.startswith(prefix) for user in found):
+            self.error("query {}: {}".format(
+                prefix, [(user.id, user.email) for user in found]))
+        return found
+
+    def read(self, rng: random.Random):
+        """
+        One read of a random user.
+        """
+        i = rng.randrange(self.count)
+        if i < self.stable:
+            user = User.get("user-{}".format(i))
+            if user is None or user.email != email(i):
+                self.error("get user-{}: {}".format(i, user))
+            if len(self.check_search(email(i))) != 1:
+                self.error("search {}: not found once".format(email(i)))
+            if len(self.check_query(email(i))) != 1:
+                self.error("query {}: not found once".format(email(i)))
+        else:
+            user = User.get("user-{}".format(i))
+            if user is not None and user.id != "user-{}".format(i):
+                self.error("get user-{}: {}".format(i, user.id))
+            self.check_search(email(i, rng.random() < 0.5))
+            self.check_query(email(i, rng.random() < 0.5))
+
+    def write(self, rng: random.Random):
+        """
+        One save or remove of a random user.
+        """
+        i = rng.randrange(self.count)
+        user = User.get("user-{}".format(i))
+        if i < self.stable:
+            user.save()
+        elif user is None:
+            make_user(i, rng.random() < 0.5).save()
+        elif rng.random() < 0.2:
+            user.remove()
+        else:
+            user.email = email(i, user.email == email(i))
+            user.save()
+
+    def check_all(self):
+        """
+        Checks all() against the stable users.
+        """
+        users = User.all()
+        ids = {user.id for user in users}
+        if len(ids) != len(users):
+            self.error("all: duplicates")
+        missing = sum("user-{}".format(i) not in ids
+                      for i in range(self.stable))
+        if missing:
+            self.error("all: {} stable users missing".format(missing))
+
+    def worker(self, seed: int):
+        """
+        Body of the reader/writer threads.
+        """
+        rng = random.Random(seed)
+        operations = 0
+        try:
+            while time.monotonic() < self.deadline:
+                for _ in range(100):
+                    if rng.random() < self.writes:
+                        self.write(rng)
+                    else:
+                        self.read(rng)
+                operations += 100
+                if rng.random() < 0.01:
+                    self.check_all()
+                    operations += 1
+        except Exception as e:
+            self.error("{}: {}".format(type(e).__name__, e))
+        with self.lock:
+            self.operations += operations
+
+    def snapshotter(self):
+        """
+        Body of the thread that rewrites and checks the snapshot.
+        """
+        try:
+            while time.monotonic() < self.deadline:
+                User.save_to_file()
+                with open(User._snapshot_path()) as f:
+                    saved = json.load(f)
+                missing = sum("user-{}".format(i) not in saved
+                              for i in range(self.stable))
+                if missing:
+                    self.error("snapshot: {} stable users missing"
+                               .format(missing))
+                self.snapshots += 1
+                time.sleep(0.05)
+        except Exception as e:
+            self.error("snapshot {}: {}".format(type(e).__name__, e))
+
+
+def email(i: int, other: bool = False) -> str:
+    """
+    Email of user i (a churned user toggles to the other one).
+    """
+    return "user{}@example.{}".format(i, "org" if other else "com")
+
+
+def make_user(i: int, other: bool = False) -> User:
+    """
+    Builds user i.
+    """
+    return User(id="user-{}".format(i), email=email(i, other),
+                first_name="First{}".format(i), last_name="Last{}".format(i))
+
+
+def populate(count: int, lazy: bool):
+    """
+    Fills the store with count users, then reloads it (lazily with lazy).
+    """
+    User.load_from_file(lazy=False)
+    for i in range(count):
+        user = make_user(i)
+        user.password = "password{}".format(i)
+        user.save()
+    User.flush()
+    User.save_to_file()
+    User.load_from_file(lazy=lazy)
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Multithreaded stress test of the model store.")
+    parser.add_argument('-n', '--users', type=int, default=20000)
+    parser.add_argument('-t', '--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('-d', '--seconds', type=float, default=2.0)
+    parser.add_argument('-w', '--writes', type=float, default=0.05)
+    parser.add_argument('--lazy', action='store_true',
+                        help="load the store lazily before every run")
+    args = parser.parse_args(argv)
+
+    User.persistence = "snapshot"
+    User.durability = "shutdown"
+    User.snapshot_format = "json"
+    cwd = os.getcwd()
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            for threads in args.threads:
+                populate(args.users, args.lazy)
+                run = Run(args.users, args.writes, args.seconds)
+                workers = [threading.Thread(target=run.worker, args=(seed,))
+                           for seed in range(threads)]
+                workers.append(threading.Thread(target=run.snapshotter))
+                start = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+                run.check_all()
+                print("{:>2} threads {:>10,.0f} ops/s  {:>3} snapshots  {}"
+                      .format(threads, run.operations / elapsed,
+                              run.snapshots,
+                              "ok" if not run.errors else "FAILED"))
+                for message in run.errors:
+                    print("    " + message)
+                failed = failed or bool(run.errors)
+        finally:
+            # The changes left pending would be flushed at exit, once
+            # the directory is gone.
+            base.PENDING.pop(User, None)
+            os.chdir(cwd)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())